@@ -0,0 +1,68 @@
+"""Per-request database setup latency, before/after the engine registry.
+
+before: a new create_engine(echo=True) per request, as load_logged_in_user used to do
+after:  the process-wide pooled engine from finance.db.get_db
+
+    python bench/engine.py [-n 2000]
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from finance import db as fdb
+from finance.model import Base
+
+
+def request(engine):
+    # what a typical view does: one session, one indexed read
+    with Session(bind=engine) as s:
+        s.execute(text("SELECT cash FROM user WHERE id = 1")).scalar()
+
+
+def measure(n, get_engine):
+    samples = []
+    for _ in range(n):
+        t = time.perf_counter()
+        request(get_engine())
+        samples.append((time.perf_counter() - t) * 1000)
+    samples.sort()
+    return {
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[int(len(samples) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = fdb.get_db(path=path)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as c:
+        c.execute(text("INSERT INTO user (username, hash, cash) VALUES ('bench', '', 1000000)"))
+
+    after = measure(args.n, lambda: fdb.get_db(path=path))
+
+    # echo=True logs to stdout, keep it out of the report
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        before = measure(args.n, lambda: create_engine("sqlite+pysqlite:///" + path, echo=True))
+
+    print(f"{'ms/request':<12}{'mean':>10}{'p50':>10}{'p95':>10}")
+    for label, r in (("before", before), ("after", after)):
+        print(f"{label:<12}{r['mean']:>10.3f}{r['p50']:>10.3f}{r['p95']:>10.3f}")
+    print(f"speedup (mean): {before['mean'] / after['mean']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
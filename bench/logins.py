@@ -0,0 +1,86 @@
+"""Login throughput, and how much a login burst stalls other requests.
+
+Posts -n logins from --threads client threads while one more thread keeps
+requesting /hello, first hashing on the request thread (PASSWORD_WORKERS
+= 0), then in a pool of --workers processes. With --queue below --threads,
+the excess logins are turned away (503) instead of waiting.
+
+    python bench/logins.py [-n 64 --threads 8 --workers 4 --queue 4]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from finance import create_app
+from finance import db as fdb
+
+
+def burst(app, n, threads):
+    """Return (logins/s, login p50 ms, /hello p95 ms, rejected, slowest rejection ms)"""
+    local = threading.local()
+    done = threading.Event()
+    probes = []
+
+    def probe():
+        client = app.test_client()
+        while not done.is_set():
+            t = time.perf_counter()
+            client.get("/hello")
+            probes.append((time.perf_counter() - t) * 1000)
+            time.sleep(0.005)
+
+    def login(i):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        t = time.perf_counter()
+        r = local.client.post("/auth/login", data={"username": "bench", "password": "bench"})
+        assert r.status_code in (302, 503), r.status_code
+        return (time.perf_counter() - t) * 1000, r.status_code == 503
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(login, range(n)))
+    samples = [ms for ms, busy in results if not busy]
+    rejected = [ms for ms, busy in results if busy]
+    wall = time.perf_counter() - t
+    done.set()
+    prober.join()
+
+    probes.sort()
+    return (
+        len(samples) / wall, statistics.median(samples), probes[int(len(probes) * 0.95)],
+        len(rejected), max(rejected, default=0),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=64, help="logins per run")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--workers", type=int, default=4, help="hashing processes")
+    parser.add_argument("--queue", type=int, default=None, help="PASSWORD_QUEUE, default -n")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    fdb.init_db(fdb.get_db(path=path))
+    config = {"DATABASE": path, "SECRET_KEY": "bench", "TESTING": True, "PASSWORD_QUEUE": args.queue or args.n}
+
+    print(f"{'hashing':<14}{'logins/s':>10}{'login p50 ms':>14}{'/hello p95 ms':>15}{'rejected':>10}{'in ms':>7}")
+    for label, workers in (("request thread", 0), (f"{args.workers} processes", args.workers)):
+        app = create_app({**config, "PASSWORD_WORKERS": workers})
+        app.test_client().post("/auth/register", data={"username": "bench", "password": "bench"})
+        app.test_client().post("/auth/login", data={"username": "bench", "password": "bench"})  # start the pool
+        rate, p50, hello, rejected, slowest = burst(app, args.n, args.threads)
+        print(f"{label:<14}{rate:>10.1f}{p50:>14.0f}{hello:>15.1f}{rejected:>10}{slowest:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
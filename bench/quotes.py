@@ -0,0 +1,151 @@
+"""Quote gateway against a local delayed-response vendor stub.
+
+Starts an HTTP stub that answers after --latency ms and points
+helpers.lookup at it. Then:
+
+    basket  one order's worth of symbols: sequential lookups vs gateway.fetch_many
+    trade   --workers concurrent clients posting /trade, with and without
+            QUOTE_TIMEOUT, while a --stall fraction of lookups take
+            --stall-ms; worker time per request is what a WSGI worker
+            pool is charged
+
+    python bench/quotes.py [--latency 100 --stall 0.1 --stall-ms 3000]
+                           [--workers 8 -n 200 --basket 20 --timeout 0.5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from finance import create_app, gateway, helpers, quotes
+from finance import db as fdb
+
+
+def start_stub(latency, stall_ms, stub):
+    """Serve /<symbol> as a JSON quote after a delay, return the base url
+
+    stub["stall"] is the fraction of requests delayed by stall_ms instead.
+    """
+    rng = random.Random(0)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep((stall_ms if rng.random() < stub["stall"] else latency) / 1000)
+            symbol = self.path.strip("/").upper()
+            body = json.dumps({"name": symbol, "price": 100.0, "symbol": symbol}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 256    # default backlog of 5 would serialize bursts
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/"
+
+
+def make_app(path, timeout):
+    return create_app({
+        "DATABASE": path,
+        "SECRET_KEY": "bench",
+        "TESTING": True,
+        "QUOTE_TTL": 0,
+        "QUOTE_TRADE_MAX_AGE": 0,
+        "QUOTE_TIMEOUT": timeout,
+    })
+
+
+def basket(app, n):
+    symbols = [f"B{i:03d}" for i in range(n)]
+    with app.app_context():
+        t = time.perf_counter()
+        for symbol in symbols:
+            quotes.lookup(symbol)
+        sequential = time.perf_counter() - t
+
+        t = time.perf_counter()
+        asyncio.run(gateway.fetch_many(symbols, max_age=0))
+        concurrent = time.perf_counter() - t
+    return sequential, concurrent
+
+
+def trades(app, workers, n):
+    """Post n /trade requests from `workers` threads, return per-request seconds"""
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+            local.client.post("/auth/login", data={"username": "bench", "password": "bench"})
+        t = time.perf_counter()
+        local.client.post("/trade", data={
+            "symbol": f"T{i % 500:03d}", "shares": 1, "type": "buy", "view": "main.trade"
+        })
+        return time.perf_counter() - t
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sorted(pool.map(one, range(n)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=100, help="vendor latency, ms")
+    parser.add_argument("--stall", type=float, default=0.1, help="fraction of stalled lookups")
+    parser.add_argument("--stall-ms", type=float, default=3000)
+    parser.add_argument("--workers", type=int, default=8, help="concurrent clients")
+    parser.add_argument("-n", type=int, default=200, help="trades per run")
+    parser.add_argument("--basket", type=int, default=20, help="symbols per basket")
+    parser.add_argument("--timeout", type=float, default=0.5, help="QUOTE_TIMEOUT, seconds")
+    args = parser.parse_args()
+
+    stub = {"stall": 0.0}
+    url = start_stub(args.latency, args.stall_ms, stub)
+
+    def lookup(symbol):
+        with urllib.request.urlopen(url + symbol) as r:
+            return json.load(r)
+    helpers.lookup = lookup
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    fdb.init_db(fdb.get_db(path=path))
+    app = make_app(path, None)
+    app.test_client().post("/auth/register", data={"username": "bench", "password": "bench"})
+
+    sequential, concurrent = basket(app, args.basket)
+    print(f"basket of {args.basket}, no stalls: sequential {sequential * 1000:.0f} ms, "
+          f"gateway {concurrent * 1000:.0f} ms ({sequential / concurrent:.1f}x)")
+
+    stub["stall"] = args.stall
+    print(f"/trade, {args.workers} workers, {args.stall:.0%} of lookups stall {args.stall_ms:.0f} ms")
+    print(f"{'timeout':<10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'worker s':>10}{'req/s':>8}")
+    for timeout in (None, args.timeout):
+        app = make_app(path, timeout)
+        t = time.perf_counter()
+        samples = trades(app, args.workers, args.n)
+        wall = time.perf_counter() - t
+        print(
+            f"{str(timeout):<10}{statistics.median(samples) * 1000:>10.0f}"
+            f"{samples[int(len(samples) * 0.95)] * 1000:>10.0f}{samples[-1] * 1000:>10.0f}"
+            f"{sum(samples):>10.1f}{args.n / wall:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Per-route latency and query counts against a seeded database.
+
+Seeds users x assets x trades (see finance.audit.seed), swaps helpers.lookup
+for a deterministic local quote stub with configurable latency, and drives
+each route through the Flask test client.
+
+    python bench/routes.py [-n 200] [--users 1000 --assets 500 --trades 100000]
+                           [--latency 50] [--save bench/baseline.json]
+                           [--baseline bench/baseline.json --tolerance 0.2]
+
+Against a baseline, exits 1 when a route's p95 grows past the tolerance or
+it issues more queries per request.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import re
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from finance import create_app, helpers, leaderboard
+from finance import db as fdb
+from finance.audit import seed
+
+
+def quote_stub(latency):
+    """Return a lookup() stand-in: a stable price per symbol after `latency` ms"""
+    def lookup(symbol):
+        time.sleep(latency / 1000)
+        if not symbol or not symbol.isalnum():
+            return None
+        h = int(hashlib.md5(symbol.upper().encode()).hexdigest()[:8], 16)
+        return {"name": f"Asset {symbol}", "price": 5 + h % 49500 / 100, "symbol": symbol.upper()}
+    return lookup
+
+
+def routes(rng, symbols):
+    """(name, make) per route; make() returns a (method, url, data) request"""
+    return [
+        ("index", lambda: ("get", "/", None)),
+        ("trade", lambda: ("post", "/trade", {
+            "symbol": rng.choice(symbols), "shares": 1, "type": "buy", "view": "main.trade"
+        })),
+        ("quote", lambda: ("post", "/quote", {"symbol": rng.choice(symbols)})),
+        ("search", lambda: ("get", "/search?q=" + rng.choice(symbols)[:3], None)),
+        ("stat.history", lambda: ("get", "/stat/history", None)),
+        ("stat.leaders", lambda: ("get", f"/stat/leaders?page={rng.randint(1, 3)}", None)),
+        ("stat.performance", lambda: ("get", "/stat/performance.json", None)),
+    ]
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = create_app({
+        "DATABASE": path,
+        "SECRET_KEY": "bench",
+        "TESTING": True,
+        "PRICE_REFRESH_THREAD": False,
+        "QUOTE_TTL": args.quote_ttl,
+        "SERVER_TIMING": True,
+    })
+    engine = fdb.get_db(path=path)
+    fdb.init_db(engine)
+    seed(engine, args.users, args.assets, args.trades, rng)
+    with fdb.Session() as db:
+        leaderboard.rebuild(db)
+        db.commit()
+    with engine.begin() as c:
+        c.exec_driver_sql(
+            "UPDATE user SET hash = ? WHERE username = 'user0'", (generate_password_hash("bench"),)
+        )
+
+    helpers.lookup = quote_stub(args.latency)
+    symbols = [f"S{i:04d}" for i in range(args.assets)]
+
+    # Statements per request as counted by finance.metrics on g: whatever
+    # thread runs the view (async views run on asgiref's loop thread), but
+    # not background writers
+    queries = re.compile(r'desc="(\d+) queries"')
+
+    client = app.test_client()
+    client.post("/auth/login", data={"username": "user0", "password": "bench"})
+
+    results = {}
+    for name, make in routes(rng, symbols):
+        for _ in range(args.warmup):
+            method, url, data = make()
+            getattr(client, method)(url, data=data)
+
+        samples, counts = [], []
+        for _ in range(args.n):
+            method, url, data = make()
+            t = time.perf_counter()
+            r = getattr(client, method)(url, data=data)
+            samples.append((time.perf_counter() - t) * 1000)
+            counts.append(int(queries.search(r.headers["Server-Timing"]).group(1)))
+            if r.status_code >= 400:
+                raise SystemExit(f"{name}: {method.upper()} {url} returned {r.status_code}")
+        samples.sort()
+        results[name] = {
+            "p50": percentile(samples, 0.50),
+            "p95": percentile(samples, 0.95),
+            "p99": percentile(samples, 0.99),
+            "queries": sum(counts) / len(counts),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print results beside the baseline, return the routes that regressed"""
+    regressed = []
+    print(f"{'route':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}  vs baseline")
+    for name, r in results.items():
+        line = f"{name:<18}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['p99']:>10.2f}{r['queries']:>9.1f}"
+        b = baseline.get(name)
+        if b:
+            delta = r["p95"] / b["p95"] - 1 if b["p95"] else 0.0
+            line += f"  p95 {delta:+.0%}, queries {r['queries'] - b['queries']:+.1f}"
+            if delta > tolerance or r["queries"] > b["queries"]:
+                regressed.append(name)
+                line += "  REGRESSED"
+        print(line)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200, help="requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per route")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--assets", type=int, default=500)
+    parser.add_argument("--trades", type=int, default=100_000)
+    parser.add_argument("--latency", type=float, default=50, help="quote stub latency, ms")
+    parser.add_argument("--quote-ttl", type=float, default=60, help="QUOTE_TTL, 0 to always call the stub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth")
+    parser.add_argument("--save", help="write results as a new baseline")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["routes"]
+    regressed = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        config = {k: getattr(args, k) for k in ("n", "users", "assets", "trades", "latency", "quote_ttl", "seed")}
+        with open(args.save, "w") as f:
+            json.dump({"config": config, "routes": results}, f, indent=2)
+
+    if regressed:
+        print("regressed: " + ", ".join(regressed))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
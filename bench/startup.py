@@ -0,0 +1,76 @@
+"""Worker cold-start time: import, create_app, and the first request.
+
+Each sample is a fresh interpreter, as a newly forked or scaled-out worker
+would be. Modes:
+
+    cold    empty Jinja bytecode cache
+    cached  bytecode cache filled by an earlier process
+    warmup  cached, plus WARMUP = True (templates and DB pool before traffic)
+
+    python bench/startup.py [-n 10]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in the child interpreter; prints its timings as JSON
+child = '''
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+from finance import create_app
+t1 = time.perf_counter()
+app = create_app({config!r}, instance_path={instance!r})
+t2 = time.perf_counter()
+r = app.test_client().get("/auth/login")
+t3 = time.perf_counter()
+assert r.status_code == 200, r.status_code
+print(json.dumps({{"import": t1 - t0, "create_app": t2 - t1, "first_request": t3 - t2, "total": t3 - t0}}))
+'''
+
+
+def sample(config, instance):
+    out = subprocess.run(
+        [sys.executable, "-c", child.format(root=root, config=config, instance=instance)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=10)
+    args = parser.parse_args()
+
+    # The app and its bytecode cache live in a temporary instance folder,
+    # never the working tree's
+    instance = tempfile.mkdtemp()
+    config = {"DATABASE": os.path.join(instance, "startup.db"), "SECRET_KEY": "bench"}
+    cache = os.path.join(instance, "jinja-cache")
+
+    modes = {}
+    try:
+        for mode, extra in (("cold", {}), ("cached", {}), ("warmup", {"WARMUP": True})):
+            runs = []
+            for _ in range(args.n):
+                if mode == "cold":
+                    shutil.rmtree(cache, ignore_errors=True)
+                runs.append(sample({**config, **extra}, instance))
+            modes[mode] = {k: statistics.median(r[k] for r in runs) * 1000 for k in runs[0]}
+    finally:
+        shutil.rmtree(instance, ignore_errors=True)
+
+    print(f"{'median ms':<10}{'import':>10}{'create_app':>12}{'first req':>11}{'total':>10}")
+    for mode, m in modes.items():
+        print(f"{mode:<10}{m['import']:>10.1f}{m['create_app']:>12.1f}{m['first_request']:>11.1f}{m['total']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
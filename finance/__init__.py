@@ -3,10 +3,52 @@ from flask import Flask, g
 
 
 # Create, configure the app
-def create_app(test_config=None):
-    app = Flask(__name__, instance_relative_config=True)
+def create_app(test_config=None, instance_path=None):
+    app = Flask(__name__, instance_path=instance_path, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY = "dev",
+        PASSWORD_METHOD = "pbkdf2:sha256:600000",   # hashes made otherwise are upgraded at login
+        PASSWORD_WORKERS = 0,       # hashing processes, 0 = hash on the request thread
+        PASSWORD_QUEUE = 16,        # hashes in progress before logins are turned away
+        DATABASE = os.path.join(app.instance_path, "finance.db"),
+        DB_POOL_SIZE = 5,
+        DB_MAX_OVERFLOW = 10,
+        DB_ECHO = False,
+        DB_PRAGMAS = None,  # None = finance.db.default_pragmas
+        LEADERS_PER_PAGE = 50,
+        HISTORY_PER_PAGE = 100,
+        QUOTE_CACHE_SIZE = 1024,
+        QUOTE_TTL = 60,             # seconds, quote and search views
+        QUOTE_TRADE_MAX_AGE = 5,    # seconds, prices that fill trades and orders
+        QUOTE_TIMEOUT = 5,          # seconds an async view waits on the vendor
+        QUOTE_CONCURRENCY = 32,     # vendor lookups in flight per process
+        BATCH_MAX_ORDERS = 100,     # legs per /trade/batch request
+        SEARCH_LIMIT = 8,           # results per /search
+        SEARCH_CACHE_SIZE = 512,    # cached prefixes
+        SEARCH_CACHE_TTL = 30,      # seconds
+        BADGES_ASYNC = True,        # write earned badges off the request path
+        ORDERS_ASYNC = True,        # fill crossed limit orders off the request path
+        PERFORMANCE_CACHE_SIZE = 256,   # users with a memoized performance series
+        PERFORMANCE_CACHE_TTL = 3600,
+        RESET_BATCH_SIZE = 5000,    # rows deleted per transaction
+        RESET_PAUSE = 0.01,         # seconds between batches
+        RESET_STALE_AFTER = 300,    # seconds without progress before a running reset counts as dead
+        PRICE_REFRESH_THREAD = False,   # run the refresher inside this process
+        PRICE_REFRESH_INTERVAL = 60,    # seconds between cycles
+        PRICE_REFRESH_MAX_BACKOFF = 900,
+        PRICE_REFRESH_BATCH = 50,       # symbols per batch
+        PRICE_REFRESH_WORKERS = 8,      # concurrent lookups per batch
+        METRICS = False,            # serve /metrics in Prometheus text format
+        METRICS_TOKEN = None,       # required "Authorization: Bearer" token; unset = open to all
+        SERVER_TIMING = True,       # per-request db and app time header
+        SLOW_QUERY_MS = 100,        # None = no slow-query log
+        SLOW_QUERY_LOG = "slow-query.log",  # in the instance folder, None = app log only
+        PROFILER = False,           # enable /profile/* on this worker
+        PROFILER_TOKEN = None,      # required X-Profiler-Token header; unset = endpoints refuse all
+        PROFILER_INTERVAL = 0.005,  # seconds between stack samples
+        PROFILER_MAX_SECONDS = 60,  # longest sampling run
+        JINJA_BYTECODE_CACHE = True,    # compiled templates kept in the instance folder
+        WARMUP = False,             # compile templates and fill the DB pool in create_app
     )
 
    # Load instance config
@@ -31,6 +73,54 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    from . import passwords
+    passwords.init_app(app)
+
+    from . import caching
+    caching.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
+    from . import profiler
+    profiler.init_app(app)
+
+    from . import quotes
+    quotes.init_app(app)
+
+    from . import gateway
+    gateway.init_app(app)
+
+    from . import search
+    search.init_app(app)
+
+    from . import leaderboard
+    leaderboard.init_app(app)
+
+    from . import achievements
+    achievements.init_app(app)
+
+    from . import performance
+    performance.init_app(app)
+
+    from . import book
+    book.init_app(app)
+
+    from . import refresh
+    refresh.init_app(app)
+
+    from . import costbasis
+    costbasis.init_app(app)
+
+    from . import importer
+    importer.init_app(app)
+
+    from . import ledger
+    ledger.init_app(app)
+
+    from . import audit
+    audit.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.bp)
     
@@ -41,4 +131,9 @@ def create_app(test_config=None):
     app.register_blueprint(main.bp)
     app.add_url_rule("/", endpoint="index")
 
+    from . import startup
+    startup.init_app(app)
+    if app.config["WARMUP"]:
+        startup.warmup(app)
+
     return app   
\ No newline at end of file
@@ -0,0 +1,132 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, session
+from sqlalchemy import text
+
+from finance import caching
+from finance.db import Session
+
+
+# A trade as seen by achievement rules
+TradeEvent = namedtuple("TradeEvent", ["type", "shares", "view", "profit"])
+
+# An achievement: award skull `skull_id` when test(event, new) is true,
+# `new` being the skull ids this event has earned so far
+Rule = namedtuple("Rule", ["skull_id", "test"])
+
+rules = [
+    Rule(1, lambda e, new: True),                               # s1: make a trade
+    Rule(2, lambda e, new: e.view == 'index'),                  # s2: no time wasted
+    Rule(4, lambda e, new: e.type == 'sell' and e.profit),      # s4: profiteer
+    Rule(5, lambda e, new: e.shares > 999),                     # s5: big bags
+    Rule(3, lambda e, new: len(new) > 1),                       # s3: two-fer
+]
+
+
+# Earned badges are kept as a bitset, bit n set = skull n earned
+
+def load(db, user_id):
+    """Return the badge bitset of a user from the badge table"""
+    mask = 0
+    for skull_id in db.execute(
+        text('SELECT skull_id FROM badge WHERE user_id = :i'), {"i": user_id}
+    ).scalars():
+        mask |= 1 << skull_id
+    return mask
+
+
+def earned():
+    """Return the logged in user's badge bitset, cached in the session
+
+    Reloaded after a reset, or after a background badge write of the user failed.
+    """
+    version = caching.version("badges")
+    stale = current_app.extensions["badges_stale"]
+    if "badges" not in session or session.get("badges_version") != version or session["user_id"] in stale:
+        stale.discard(session["user_id"])
+        with Session() as db:
+            session["badges"] = load(db, session["user_id"])
+        session["badges_version"] = version
+    return session["badges"]
+
+
+def ids(mask):
+    """Return the skull ids set in a bitset"""
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+def skulls():
+    """Return {skull id: name}, loaded once per process"""
+    names = current_app.extensions.get("skulls")
+    if not names:
+        with Session() as db:
+            names = dict(db.execute(text('SELECT id, name FROM skull')).all())
+        current_app.extensions["skulls"] = names
+    return names
+
+
+def evaluate(mask, event, known):
+    """Return the skull ids, among `known`, newly earned by event"""
+    new = []
+    for rule in rules:
+        if rule.skull_id in known and not mask >> rule.skull_id & 1 and rule.test(event, new):
+            new.append(rule.skull_id)
+    return new
+
+
+def persist(user_id, new):
+    """Insert earned badges in one statement"""
+    with Session() as db:
+        db.execute(text(
+            'INSERT OR IGNORE INTO badge (skull_id, user_id) VALUES (:s, :i)'
+            ), [{"s": skull_id, "i": user_id} for skull_id in new]
+        )
+        db.commit()
+
+
+def write(app, user_id, new):
+    """persist on the badge writer thread; if it fails the badges shown are reloaded"""
+    with app.app_context():
+        try:
+            persist(user_id, new)
+        except Exception:
+            app.logger.exception("badge write failed: user %s", user_id)
+            app.extensions["badges_stale"].add(user_id)
+            try:
+                # sessions held by other processes
+                with Session() as db:
+                    caching.bump(db, "badges")
+                    db.commit()
+            except Exception:
+                app.logger.exception("badge version bump failed")
+
+
+def award(user_id, event):
+    """Evaluate rules for a trade by the logged in user, return names of new badges
+
+    The session bitset is updated once the badge rows are written. With
+    BADGES_ASYNC they are written by a background thread, off the request
+    path, and the bitset is updated right away; if that write fails it is
+    reloaded from the badge table.
+    """
+    names = skulls()
+    mask = earned()
+    new = evaluate(mask, event, names)
+    if not new:
+        return []
+
+    for skull_id in new:
+        mask |= 1 << skull_id
+
+    if current_app.config["BADGES_ASYNC"]:
+        current_app.extensions["badge_writer"].submit(write, current_app._get_current_object(), user_id, new)
+    else:
+        persist(user_id, new)
+    session["badges"] = mask
+    return [names[skull_id] for skull_id in new]
+
+
+def init_app(app):
+    app.extensions["badge_writer"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="badges")
+    app.extensions["badges_stale"] = set()     # user ids whose badge write failed
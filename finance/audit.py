@@ -0,0 +1,195 @@
+import os
+import random
+import re
+import tempfile
+import time
+
+import click
+from flask import current_app
+from sqlalchemy import event, text
+
+from finance import db as database
+from finance.model import default_cash
+
+
+# Plan rows that read a whole table; index scans ("USING INDEX ...") and
+# virtual tables (fts) are fine
+full_scan = re.compile(r"^SCAN (\w+)$")
+
+
+def seed(engine, users, assets, trades, rng):
+    """Fill an empty database with random users, assets, holdings and trades"""
+    with engine.begin() as c:
+        c.execute(text(
+            "INSERT INTO user (username, hash, cash) VALUES (:u, '', :c)"
+            ), [{"u": f"user{i}", "c": default_cash} for i in range(users)]
+        )
+        c.execute(text(
+            "INSERT INTO settings (user_id, theme) SELECT id, 'light' FROM user"
+        ))
+        c.execute(text(
+            "INSERT INTO asset (symbol, name, price) VALUES (:s, :n, :p)"
+            ), [{"s": f"S{i:04d}", "n": f"Asset {i}", "p": rng.uniform(5, 500)} for i in range(assets)]
+        )
+        c.execute(text(
+            "INSERT INTO skull (name, description) VALUES (:n, :d)"
+            ), [{"n": f"skull{i}", "d": ""} for i in range(1, 6)]
+        )
+        c.execute(text(
+            '''
+            INSERT INTO trade (type, user_id, asset_id, qty, price, time)
+            VALUES ('buy', :i, :a, :n, :p, datetime('now', :t))
+            '''), [
+                {
+                    "i": rng.randint(1, users),
+                    "a": rng.randint(1, assets),
+                    "n": rng.randint(1, 100),
+                    "p": rng.uniform(5, 500),
+                    "t": f"-{n} minutes",
+                }
+                for n in range(trades)
+            ]
+        )
+        c.execute(text(
+            '''
+            INSERT INTO holding (asset_id, user_id, qty, basis, realized)
+            SELECT asset_id, user_id, sum(qty), sum(qty * price), 0 FROM trade
+            GROUP BY asset_id, user_id
+            '''
+        ))
+
+
+def drive(client, symbols):
+    """Exercise every blueprint route the way a user would"""
+    client.post("/auth/register", data={"username": "audit", "password": "audit"})
+    client.post("/auth/login", data={"username": "audit", "password": "audit"})
+    client.get("/")
+    client.get("/trade")
+    client.post("/trade", data={"symbol": symbols[0], "shares": 2, "type": "buy", "view": "main.trade"})
+    client.post("/trade", data={"symbol": symbols[0], "shares": 1, "type": "sell", "view": "index"})
+    client.post("/trade", data={"symbol": "AUDIT", "shares": 1, "type": "buy", "view": "main.trade"})
+    client.post("/trade/batch", json={"orders": [
+        {"symbol": symbols[1], "shares": 3, "type": "buy"},
+        {"symbol": symbols[1], "shares": 1, "type": "sell"},
+    ]})
+    client.post("/quote", data={"symbol": symbols[2]})
+    client.post("/order", data={"symbol": symbols[4], "shares": 1, "type": "buy", "limit": 1e6})
+    client.post("/order", data={"symbol": symbols[4], "shares": 1, "type": "buy", "limit": 0.01})
+    client.get("/trade")
+    client.post("/order/2/cancel")
+    client.get("/search?q=" + symbols[3][:3])
+    client.get("/search?q=asset 1")
+    client.get("/stat/history")
+    client.get("/stat/history?before=9999-12-31 00:00:00|0")
+    client.get("/stat/history/export?format=csv")
+    client.get("/stat/performance")
+    client.get("/stat/bars/" + symbols[0] + "?res=7200")
+    client.get("/stat/bars/" + symbols[0] + "?res=30")
+    client.get("/stat/leaders")
+    client.get("/stat/leaders?page=2")
+    client.get("/settings")
+    client.post("/settings", data={"theme": "dark"})
+    client.post("/settings", data={"reset": "me"})
+
+
+def explain(conn, statement, parameters):
+    """Return the EXPLAIN QUERY PLAN detail rows of one statement"""
+    cur = conn.cursor()
+    try:
+        return [row[-1] for row in cur.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+    finally:
+        cur.close()
+
+
+def audit(users=200, assets=100, trades=5000, allow=("skull",), seed_value=0):
+    """Run the blueprints against a seeded database, return [(statement, plan, scans)]"""
+    from finance import create_app
+
+    rng = random.Random(seed_value)
+    path = os.path.join(tempfile.mkdtemp(), "audit.db")
+    app = create_app({
+        **current_app.config,
+        "DATABASE": path,
+        "TESTING": True,
+        "PRICE_REFRESH_THREAD": False,
+        "BADGES_ASYNC": False,
+        "ORDERS_ASYNC": False,
+    })
+    engine = database.get_db(path=path)
+    database.init_db(engine)
+    seed(engine, users, assets, trades, rng)
+
+    # Serve quotes from the cache, never the vendor
+    symbols = [f"S{i:04d}" for i in range(assets)] + ["AUDIT"]
+    for symbol in symbols:
+        app.extensions["quotes"].set(symbol, {
+            "name": symbol, "price": rng.uniform(5, 500), "symbol": symbol
+        }, ttl=3600)
+
+    seen = {}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0]
+        seen.setdefault(statement, parameters)
+
+    try:
+        drive(app.test_client(), symbols)
+
+        # the reset posted by drive() deletes in a background thread; let it
+        # finish on this database before Session is bound back
+        deadline = time.monotonic() + 60
+        with engine.connect() as c:
+            while time.monotonic() < deadline and c.execute(
+                text("SELECT id FROM job WHERE kind = 'reset' AND state = 'running'")
+            ).first() is not None:
+                c.rollback()
+                time.sleep(0.05)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+        database.Session.configure(bind=database.get_db(path=current_app.config["DATABASE"]))
+
+    report = []
+    conn = engine.raw_connection()
+    try:
+        for statement, parameters in seen.items():
+            if not re.match(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH)", statement, re.I):
+                continue
+            plan = explain(conn, statement, parameters)
+            scans = [
+                m.group(1) for m in map(full_scan.match, plan)
+                if m and m.group(1) not in allow
+            ]
+            report.append((statement, plan, scans))
+    finally:
+        conn.close()
+    return report
+
+
+# Add cli command
+@click.command("audit-queries")
+@click.option("--users", default=200, help="Seeded users.")
+@click.option("--assets", default=100, help="Seeded assets.")
+@click.option("--trades", default=5000, help="Seeded trades.")
+@click.option("--allow", multiple=True, default=["skull"], help="Tables allowed to be scanned.")
+@click.option("-v", "--verbose", is_flag=True, help="Print every plan.")
+def audit_queries_command(users, assets, trades, allow, verbose):
+    """EXPLAIN every statement the blueprints issue, fail on full table scans"""
+    report = audit(users=users, assets=assets, trades=trades, allow=allow)
+    failed = 0
+    for statement, plan, scans in report:
+        if scans:
+            failed += 1
+        if scans or verbose:
+            click.echo(("FULL SCAN of " + ", ".join(scans) if scans else "ok") + ":")
+            click.echo("  " + " ".join(statement.split()))
+            for row in plan:
+                click.echo("    " + row)
+    click.echo(f"{len(report)} statements, {failed} with full table scans.")
+    if failed:
+        raise SystemExit(1)
+
+
+def init_app(app):
+    app.cli.add_command(audit_queries_command)
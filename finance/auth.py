@@ -2,24 +2,15 @@ import functools
 from flask import (
     current_app, Blueprint, flash, g, redirect, render_template, request, session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 from sqlalchemy import select, text
 
-from finance.db import get_db, Session
+from finance import achievements, caching, leaderboard, passwords, prefs
+from finance.db import Session
 from finance.model import User
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
-@bp.after_app_request
-def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    return response
-
-
 @bp.before_app_request
 def load_logged_in_user():
    
@@ -32,9 +23,6 @@ def load_logged_in_user():
             "id": user_id,
             "name": name
             }
-    Session.configure(bind=
-        get_db(path=current_app.config["DATABASE"])
-    )
     return
     
 
@@ -60,17 +48,23 @@ def register():
                 if r is not None:
                     error = f"sry, {username} taken"
                 else:
-                    u = User(username=username, hash=generate_password_hash(password))
+                    try:
+                        hash = passwords.generate(password)
+                    except passwords.Busy:
+                        flash("server busy, try again")
+                        return render_template("auth/login.html", view=view), 503
+                    u = User(username=username, hash=hash)
                     du.add(u)
                     user_id = du.execute(select(User.id).where(User.username == username)).scalar()
                     du.execute(text('INSERT INTO settings (user_id) VALUES (:i)'),
                         {"i": user_id}
                     )
+                    leaderboard.update_user(du, user_id)
                     du.commit()
 
         if error is not None:
             flash(error)
-            return redirect(url_for("auth.login"), view=view)
+            return redirect(url_for("auth.login"))
         
         # Success
         return redirect(url_for("auth.login"))
@@ -95,19 +89,43 @@ def login():
                 select(User).where(
                     User.username == username
             )).scalar()
+            try:
+                valid = row is not None and passwords.check(row.hash, password)
+            except passwords.Busy:
+                flash("server busy, try again")
+                return render_template("auth/login.html", view=view), 503
+
             if row is None:
                 error = "bad username"
-            elif not check_password_hash(row.hash, password):
+            elif not valid:
                 error = "invalid credentials"
+            else:
+                user_id = row.id
+                badges_version = caching.version("badges")
+                badges = achievements.load(cur, user_id)
+                preferences = prefs.load(cur, user_id)
+
+                # Upgrade hashes made with an older method or cost
+                if passwords.needs_rehash(row.hash):
+                    try:
+                        cur.execute(text('UPDATE user SET hash = :h WHERE id = :i'),
+                            {"h": passwords.generate(password), "i": user_id}
+                        )
+                        cur.commit()
+                    except passwords.Busy:
+                        pass    # next login
 
         if error is not None:
             flash(error)
-            return redirect(url_for("auth.login"), view=view)
+            return redirect(url_for("auth.login"))
         
         session.clear()
-        session["user_id"] = row.id
+        session["user_id"] = user_id
         session["username"] = username
         session["theme"] = None
+        session["badges"] = badges
+        session["badges_version"] = badges_version
+        session["prefs"] = preferences
         return redirect(url_for("index"))      
    
     # GET
@@ -127,6 +145,7 @@ def login_required(view):
         if g.user is None:
            return redirect(url_for("auth.login"))
 
-        return view(**kwargs)
+        # async views run on an event loop, sync ones as-is
+        return current_app.ensure_sync(view)(**kwargs)
 
     return wrapped_view
\ No newline at end of file
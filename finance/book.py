@@ -0,0 +1,259 @@
+import heapq
+import threading
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from finance import orders, search
+from finance.db import Session
+
+
+# Limit orders rest in per-symbol books in memory, backed by the order
+# table. A new market price pops every order it crosses, O(log n) each,
+# and fills it at that price through orders.execute. Cash and inventory are
+# checked when an order fills, not when it is placed; orders that fail the
+# check are marked rejected.
+#
+# Each process keeps its own books and picks up orders placed elsewhere by
+# id before matching, and starts over when a reset bumps the "order"
+# version. The open -> filled update is a compare-and-set that reads the
+# order back, so an order is filled once, on its own terms, however many
+# processes see it cross.
+
+Resting = namedtuple("Resting", ["id", "type", "user_id", "symbol", "qty", "price"])
+
+orders_sql = '''
+    SELECT "order".id, "order".type, "order".user_id, asset.symbol, "order".qty, "order".price
+    FROM "order", asset
+    WHERE "order".asset_id = asset.id
+    {where}
+'''
+
+
+class Book:
+    """Resting orders of one symbol in price-time priority
+
+    buys is a max-heap on limit price (stored negated), sells a min-heap;
+    ties go to the older order, i.e. the lower id. Cancelled orders are
+    dropped when they reach the top.
+    """
+
+    def __init__(self):
+        self.buys = []
+        self.sells = []
+
+    def add(self, order):
+        if order.type == 'buy':
+            heapq.heappush(self.buys, (-order.price, order.id))
+        else:
+            heapq.heappush(self.sells, (order.price, order.id))
+
+    @staticmethod
+    def crosses(order, price):
+        """True if a market price fills the order"""
+        return price <= order.price if order.type == 'buy' else price >= order.price
+
+    def crossing(self, price):
+        """Pop and return the ids of every order a market price fills, best first"""
+        ids = []
+        while self.buys and -self.buys[0][0] >= price:
+            ids.append(heapq.heappop(self.buys)[1])
+        while self.sells and self.sells[0][0] <= price:
+            ids.append(heapq.heappop(self.sells)[1])
+        return ids
+
+
+def sync(state, db):
+    """Add open orders placed since the last sync to the books, one indexed range read
+
+    After a reset (the "order" version moved) the books are rebuilt: every
+    open order in one pass, each book heapified once. Startup is the same.
+    """
+    version = db.execute(text("SELECT n FROM version WHERE name = 'order'")).scalar() or 0
+    if version != state["version"]:
+        state["books"].clear()
+        state["live"].clear()
+        state["last"] = 0
+        state["version"] = version
+
+    rows = db.execute(text(orders_sql.format(where='''
+        AND "order".id > :last
+        AND "order".state = 'open'
+        ORDER BY "order".id
+        ''')), {"last": state["last"]}
+    ).all()
+    if not rows:
+        return
+
+    bulk = state["last"] == 0
+    books = state["books"]
+    for row in rows:
+        order = Resting(*row)
+        state["live"][order.id] = order
+        if bulk:
+            book = books[order.symbol]
+            if order.type == 'buy':
+                book.buys.append((-order.price, order.id))
+            else:
+                book.sells.append((order.price, order.id))
+        else:
+            books[order.symbol].add(order)
+    if bulk:
+        for book in books.values():
+            heapq.heapify(book.buys)
+            heapq.heapify(book.sells)
+    state["last"] = rows[-1].id
+
+
+def place(db, user_id, type, symbol, name, price, shares, limit):
+    """Insert a limit order inside the caller's transaction, return its id
+
+    price is the current quote, used only if the asset is new. Call
+    on_price after committing to fill it right away if it is marketable.
+    """
+    asset_id = db.execute(text('SELECT id FROM asset WHERE symbol = :s'), {"s": symbol}).scalar()
+    if asset_id is None:
+        asset_id = db.execute(text(
+            'INSERT INTO asset (symbol, name, price) VALUES (:s, :n, :p)'
+            ), {"s": symbol, "n": name, "p": price}
+        ).lastrowid
+        search.invalidate()
+    return db.execute(text(
+        '''
+        INSERT INTO "order" (type, user_id, asset_id, qty, price, state)
+        VALUES (:t, :i, :a, :n, :l, 'open')
+        '''), {"t": type, "i": user_id, "a": asset_id, "n": shares, "l": limit}
+    ).lastrowid
+
+
+def cancel(db, user_id, order_id):
+    """Cancel one of a user's open orders inside the caller's transaction, True if it was open"""
+    r = db.execute(text(
+        '''
+        UPDATE "order" SET state = 'cancelled'
+        WHERE id = :o AND user_id = :i AND state = 'open'
+        '''), {"o": order_id, "i": user_id}
+    )
+    current_app.extensions["book"]["live"].pop(order_id, None)
+    return r.rowcount == 1
+
+
+def open_orders(db, user_id):
+    """Return a user's open orders, newest first"""
+    return db.execute(text(
+        '''
+        SELECT "order".id, "order".type, asset.symbol, "order".qty, "order".price, "order".time
+        FROM "order", asset
+        WHERE "order".asset_id = asset.id
+        AND "order".user_id = :i
+        AND "order".state = 'open'
+        ORDER BY "order".id DESC
+        '''), {"i": user_id}
+    ).all()
+
+
+def fill(order_id, symbol, price):
+    """Fill one popped order at the market price in its own transaction
+
+    Type, user, quantity and limit come from the row claimed, never from the
+    book entry. Returns True if filled, False if the order is gone, or the
+    order as stored if it is open but this price doesn't fill it.
+    """
+    with Session() as db:
+        r = db.execute(text(
+            '''
+            UPDATE "order" SET state = 'filled' WHERE id = :o AND state = 'open'
+            '''), {"o": order_id}
+        )
+        if r.rowcount == 0:
+            return False    # cancelled, deleted, or filled by another process
+        order = Resting(*db.execute(
+            text(orders_sql.format(where='AND "order".id = :o')), {"o": order_id}
+        ).one())
+        if order.symbol != symbol or not Book.crosses(order, price):
+            db.rollback()
+            return order
+        try:
+            orders.execute(db, order.user_id, order.type, order.symbol, order.symbol, price, order.qty)
+        except orders.Rejected:
+            db.rollback()
+            db.execute(text(
+                '''
+                UPDATE "order" SET state = 'rejected' WHERE id = :o AND state = 'open'
+                '''), {"o": order.id}
+            )
+            db.commit()
+            return False
+        db.commit()
+    return True
+
+
+def on_price(quotes):
+    """Fill the resting orders crossed by new market prices {symbol: price}
+
+    Call after the transaction that stored the prices has committed. With
+    ORDERS_ASYNC the fills run on the book's single worker thread, so a
+    trade or quote request never waits on other users' orders.
+    """
+    app = current_app._get_current_object()
+    if app.config["ORDERS_ASYNC"]:
+        app.extensions["book"]["matcher"].submit(run, app, quotes)
+    else:
+        match(quotes)
+
+
+def run(app, quotes):
+    with app.app_context():
+        try:
+            match(quotes)
+        except Exception:
+            app.logger.exception("order matching failed")
+
+
+def match(quotes):
+    """Pop and fill the orders crossed by {symbol: price}, return the number filled"""
+    state = current_app.extensions["book"]
+    due = []
+    with state["lock"]:
+        with Session() as db:
+            sync(state, db)
+        for symbol, price in quotes.items():
+            book = state["books"].get(symbol)
+            if book is None:
+                continue
+            for order_id in book.crossing(price):
+                if state["live"].pop(order_id, None) is not None:
+                    due.append((order_id, symbol, price))
+
+    filled = 0
+    for order_id, symbol, price in due:
+        result = fill(order_id, symbol, price)
+        if isinstance(result, Resting):
+            # the book entry was stale; the order rests on its stored terms
+            with state["lock"]:
+                state["live"][result.id] = result
+                state["books"][result.symbol].add(result)
+        else:
+            filled += result
+    return filled
+
+
+def init_app(app):
+    state = app.extensions["book"] = {
+        "lock": threading.Lock(),
+        "books": defaultdict(Book),
+        "live": {},     # order id -> Resting, for every order still in a book
+        "last": 0,      # highest order id synced
+        "version": None,    # of "order" when the books were built
+        "matcher": ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders"),
+    }
+
+    # Rebuild the books from the open orders
+    try:
+        with Session() as db:
+            sync(state, db)
+    except OperationalError:
+        pass    # no order table until init-db
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire after a per-entry ttl (seconds)
+
+    get_or_load coalesces concurrent misses for the same key, so only one
+    caller runs the loader while the others wait for its result.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data = OrderedDict()  # key -> (stored at, expires at, value)
+        self._inflight = {}         # key -> _Flight
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key, max_age):
+        # caller holds the lock
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        stored, expires, value = entry
+        now = self.clock()
+        if now >= expires:
+            del self._data[key]
+            return None
+        if max_age is not None and now - stored > max_age:
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def get(self, key, max_age=None):
+        """Return the value for key if cached and no older than max_age, else None"""
+        with self._lock:
+            entry = self._lookup(key, max_age)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        """Store value for key, evicting the least recently used entry when full"""
+        now = self.clock()
+        with self._lock:
+            self._data[key] = (now, now + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, load, max_age=None, ttl=None):
+        """Return a cached value for key, or call load() once for all concurrent misses
+
+        None results are handed to every waiter but not cached.
+        """
+        with self._lock:
+            entry = self._lookup(key, max_age)
+            if entry is not None:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = load()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            if flight.error is None and flight.value is not None:
+                self.set(key, flight.value, ttl=ttl)
+            flight.done.set()
+        return flight.value
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+class _Flight:
+    """One in-progress load shared by concurrent callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
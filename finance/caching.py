@@ -0,0 +1,97 @@
+import functools
+import hashlib
+import os
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import text
+
+from finance.db import get_session
+
+
+# HTTP caching policy
+# - static files: fingerprinted URLs (?v=<content hash>), cached for a year
+# - shared pages: ETag from a data version, 304 before the view runs
+# - everything rendered for a logged-in user: no-store, unless the view
+#   set its own Cache-Control
+
+def bump(db, name):
+    """Advance the version of a piece of shared data, inside the caller's transaction"""
+    db.execute(text(
+        '''
+        INSERT INTO version (name, n) VALUES (:k, 1)
+        ON CONFLICT (name) DO UPDATE SET n = n + 1
+        '''), {"k": name}
+    )
+
+
+def version(name):
+    """Return the current version of a piece of shared data"""
+    return get_session().execute(
+        text('SELECT n FROM version WHERE name = :k'), {"k": name}
+    ).scalar() or 0
+
+
+def conditional(name):
+    """Serve a view with an ETag derived from the version of `name`
+
+    The tag also covers what the page renders per visitor (user, theme),
+    so a matching If-None-Match is answered with 304 without running the
+    view. Pages with pending flashed messages are always rendered.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(**kwargs):
+            if session.get("_flashes"):
+                return view(**kwargs)
+
+            key = f"{name}:{version(name)}:{request.full_path}:{g.user and g.user['id']}:{session.get('theme')}"
+            tag = hashlib.md5(key.encode()).hexdigest()
+            if request.if_none_match.contains(tag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+            response.set_etag(tag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True     # revalidate, but keep it
+            return response
+        return wrapped
+    return decorator
+
+
+def fingerprint(app, filename):
+    """Return a short content hash of a static file, memoized per process"""
+    hashes = app.extensions["static_hashes"]
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    hit = hashes.get(filename)
+    if hit is None or hit[0] != mtime:
+        with open(path, "rb") as f:
+            hit = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+        hashes[filename] = hit
+    return hit[1]
+
+
+def static_url_defaults(endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        v = fingerprint(current_app, values["filename"])
+        if v is not None:
+            values["v"] = v
+
+
+def policy(response):
+    """Apply the caching policy to responses whose view didn't set one"""
+    if request.endpoint == "static":
+        if "v" in request.args:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    elif "Cache-Control" not in response.headers and g.get("user"):
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def init_app(app):
+    app.extensions["static_hashes"] = {}
+    app.url_defaults(static_url_defaults)
+    app.after_request(policy)
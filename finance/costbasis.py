@@ -0,0 +1,78 @@
+import click
+from sqlalchemy import text
+
+from finance.db import Session
+
+
+# Holdings carry their average cost: basis is the cash paid for the shares
+# still held, realized the running gain/loss of shares already sold.
+
+def cost_of(basis, qty, shares):
+    """Return the basis of `shares` out of `qty` held"""
+    if qty <= 0:
+        return 0
+    return basis * shares / qty
+
+
+def add_columns(db):
+    """Add the basis columns to a holding table created before they existed"""
+    have = {row.name for row in db.execute(text('PRAGMA table_info(holding)'))}
+    for name in ("basis", "realized"):
+        if name not in have:
+            db.execute(text(f'ALTER TABLE holding ADD COLUMN {name} FLOAT NOT NULL DEFAULT 0'))
+
+
+def backfill(db, users=None):
+    """Recompute basis and realized P&L of every holding from the trade log
+
+    users names a table of user ids (column id) to limit the work to.
+    """
+    where = f'WHERE user_id IN (SELECT id FROM {users})' if users else ''
+    rows = db.execute(text(
+        f'''
+        SELECT user_id, asset_id, type, qty, price FROM trade
+        {where}
+        ORDER BY user_id, asset_id, time, id
+        '''))
+
+    updates = []
+    key = None
+    for user_id, asset_id, type, shares, price in rows:
+        if (user_id, asset_id) != key:
+            if key is not None:
+                updates.append({"i": key[0], "a": key[1], "b": basis, "r": realized})
+            key = (user_id, asset_id)
+            qty = basis = realized = 0
+
+        val = shares * price
+        if type == 'buy':
+            basis += val
+            qty += shares
+        else:
+            cost = cost_of(basis, qty, shares)
+            basis -= cost
+            realized += val - cost
+            qty -= shares
+    if key is not None:
+        updates.append({"i": key[0], "a": key[1], "b": basis, "r": realized})
+
+    db.execute(text(f'UPDATE holding SET basis = 0, realized = 0 {where}'))
+    if updates:
+        db.execute(text(
+            'UPDATE holding SET basis = :b, realized = :r WHERE user_id = :i AND asset_id = :a'
+        ), updates)
+    return len(updates)
+
+
+# Add cli command
+@click.command("backfill-basis")
+def backfill_basis_command():
+    with Session() as db:
+        add_columns(db)
+        n = backfill(db)
+        db.commit()
+    click.echo(f"Backfilled cost basis for {n} holdings.")
+
+
+def init_app(app):
+    app.cli.add_command(backfill_basis_command)
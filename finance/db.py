@@ -1,47 +1,110 @@
 import click
-import os
+import threading
 
-from sqlalchemy import create_engine
+from flask import current_app, g
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 
-from finance.helpers import usd
-from finance.model import Base
-from hidden import secrets
+from finance.model import asset_fts, Base
 
 
 Session = sessionmaker()
 
-def get_db(path=None):
+# Engine registry - one pooled engine per database, per process
+engines = {}
+_engines_lock = threading.Lock()
+
+# Applied to every new sqlite connection (overridden by app config DB_PRAGMAS)
+default_pragmas = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,   # negative = KiB
+}
+
+
+def get_db(path=None, pool_size=5, max_overflow=10, echo=False, pragmas=None):
+    """Return the engine for a sqlite database, creating it once per process"""
     if path is None:
-        return create_engine("sqlite+pysqlite:///instance/finance.db", echo=True)
-    else:
-        return create_engine("sqlite+pysqlite:///" + path, echo=True)
+        path = "instance/finance.db"
+    url = "sqlite+pysqlite:///" + path
+
+    with _engines_lock:
+        engine = engines.get(url)
+        if engine is None:
+            engine = create_engine(url, echo=echo, pool_size=pool_size, max_overflow=max_overflow)
+            set_pragmas(engine, default_pragmas if pragmas is None else pragmas)
+            engines[url] = engine
+    return engine
+
+
+def set_pragmas(engine, pragmas):
+    """Run PRAGMA statements on each new DBAPI connection of an engine"""
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, conn_record):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
 
 
-# Create tables
+def usd(value):
+    """helpers.usd, imported on first use to keep it off the startup path"""
+    from finance.helpers import usd
+    return usd(value)
+
+
+def get_session():
+    """Return a session shared by the current request, closed on teardown"""
+    if "db" not in g:
+        g.db = Session()
+    return g.db
+
+
+# Create tables, and any indexes missing from tables created earlier
 def init_db(engine):
     Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
+    # create_all skips an existing asset table, and with it the search index
+    with engine.begin() as c:
+        missing = c.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'asset_fts'"
+        )).first() is None
+        for stmt in asset_fts:
+            c.execute(text(stmt))
+        if missing:
+            c.execute(text("INSERT INTO asset_fts (asset_fts) VALUES ('rebuild')"))
 
-def close_db():
-    # test if a db session still active?
-    pass
+
+def close_db(e=None):
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
 
 
 # Add cli command
 @click.command("init-db")
 def init_db_command():
-    init_db(engine=get_db())
+    init_db(engine=get_db(path=current_app.config["DATABASE"]))
     click.echo("Database initialized.")
 
 
 # Register db functions with the app
 def init_app(app):
-    # app.teardown_appcontext(close_db)
+    # One engine for the life of the process, shared by every request
+    engine = get_db(
+        path=app.config["DATABASE"],
+        pool_size=app.config["DB_POOL_SIZE"],
+        max_overflow=app.config["DB_MAX_OVERFLOW"],
+        echo=app.config["DB_ECHO"],
+        pragmas=app.config["DB_PRAGMAS"],
+    )
+    Session.configure(bind=engine)
+
+    app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
     app.jinja_env.filters["usd"] = usd
-    if os.environ.get("API_KEY") is None:
-        os.environ["API_KEY"] = secrets["api"]
-
-    
-   
@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from finance.quotes import lookup
+
+
+# Async quote gateway for async views. The vendor client (helpers.lookup)
+# is blocking, so lookups run on a bounded per-process pool and are awaited
+# with a timeout: waits of concurrent orders overlap, at most
+# QUOTE_CONCURRENCY vendor calls are in flight, and a stalled vendor costs
+# a request QUOTE_TIMEOUT seconds, not the whole round trip.
+
+async def fetch(symbol, max_age=None):
+    """Return a quote dict for symbol, or None if unknown, failed or timed out"""
+    cache = current_app.extensions["quotes"]
+    gateway = current_app.extensions["quote_gateway"]
+    logger = current_app.logger
+    loop = asyncio.get_running_loop()
+    try:
+        # get_or_load answers hits, counts each miss once and keeps concurrent
+        # misses for one symbol to a single call
+        return await asyncio.wait_for(
+            loop.run_in_executor(
+                gateway["pool"], cache.get_or_load, symbol, lambda: lookup(symbol), max_age
+            ),
+            gateway["timeout"],
+        )
+    except asyncio.TimeoutError:
+        logger.warning("quote lookup timed out: %s", symbol)
+    except Exception:
+        logger.exception("quote lookup failed: %s", symbol)
+    return None
+
+
+async def fetch_many(symbols, max_age=None):
+    """Return {symbol: quote or None}, all lookups in flight together"""
+    quotes = await asyncio.gather(*(fetch(symbol, max_age) for symbol in symbols))
+    return dict(zip(symbols, quotes))
+
+
+def init_app(app):
+    app.extensions["quote_gateway"] = {
+        "pool": ThreadPoolExecutor(max_workers=app.config["QUOTE_CONCURRENCY"], thread_name_prefix="quote"),
+        "timeout": app.config["QUOTE_TIMEOUT"],
+    }
@@ -0,0 +1,218 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+import click
+from sqlalchemy import text
+
+from finance import costbasis, leaderboard
+from finance.db import Session
+from finance.model import default_cash
+
+
+# Bulk import of historical trades, e.g. when onboarding an existing account.
+# Files are read a chunk at a time and each chunk is one transaction of
+# executemany inserts; holdings and cash are derived from the trade log at
+# the end instead of row by row.
+
+def read(path, format=None):
+    """Yield rows of a csv or ndjson file as dicts, one line at a time"""
+    format = format or ("ndjson" if os.path.splitext(path)[1] in (".ndjson", ".jsonl") else "csv")
+    with open(path, newline="") as f:
+        if format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def import_assets(db, rows):
+    """Upsert asset rows (symbol, name, price, cls), return the count"""
+    params = []
+    for row in rows:
+        symbol = row["symbol"].strip().upper()
+        params.append({
+            "s": symbol,
+            "n": row.get("name") or symbol,
+            "p": float(row["price"]) if row.get("price") not in (None, "") else None,
+            "c": row.get("cls") or 'stock',
+        })
+    db.execute(text(
+        '''
+        INSERT INTO asset (symbol, name, price, cls) VALUES (:s, :n, :p, :c)
+        ON CONFLICT (symbol) DO UPDATE SET
+            name = excluded.name,
+            price = coalesce(excluded.price, price),
+            cls = excluded.cls
+        '''), params
+    )
+    return len(params)
+
+
+def parse_time(value):
+    """Return an ISO 8601 time as 'YYYY-MM-DD HH:MM:SS' UTC, like CURRENT_TIMESTAMP
+
+    History paging, cost basis and the ledger order trades by this column
+    as text, so every stored time must have the same shape.
+    """
+    try:
+        t = datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise ValueError(f"bad time {value!r}")
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse(row, users, ids):
+    """Return insert params of one trade row, raise ValueError if it is invalid"""
+    try:
+        side = row["type"].strip().lower()
+        symbol = row["symbol"].strip().upper()
+        qty = float(row["qty"])
+        price = float(row["price"])
+        user_id = int(row["user_id"]) if row.get("user_id") else users.get(row.get("username"))
+    except (KeyError, AttributeError, TypeError) as e:
+        raise ValueError(f"missing or bad field {e}")
+    if user_id not in ids:
+        raise ValueError("unknown user")
+    if side not in ('buy', 'sell') or not symbol or qty <= 0 or price <= 0:
+        raise ValueError("bad trade")
+    t = parse_time(row["time"]) if row.get("time") else None
+    return {"type": side, "s": symbol, "i": user_id, "n": qty, "p": price, "t": t}
+
+
+def import_trades(db, params, assets):
+    """Insert one chunk of parsed trades, return the ids of the users it touched
+
+    assets maps symbol to id and is extended in place; symbols not seen
+    before become assets priced at their trade.
+    """
+    new = {row["s"]: row["p"] for row in params if row["s"] not in assets}
+    if new:
+        db.execute(text(
+            'INSERT OR IGNORE INTO asset (symbol, name, price) VALUES (:s, :s, :p)'
+            ), [{"s": s, "p": p} for s, p in new.items()]
+        )
+        assets.update(db.execute(text(
+            'SELECT symbol, id FROM asset WHERE id > :a'
+            ), {"a": max(assets.values(), default=0)}
+        ).all())
+
+    # positional params straight to the driver, skipping per-row bind
+    # processing - this insert is nearly all of an import's time
+    db.connection().exec_driver_sql(
+        '''
+        INSERT INTO trade (type, user_id, asset_id, qty, price, time)
+        VALUES (?, ?, ?, ?, ?, coalesce(?, CURRENT_TIMESTAMP))
+        ''', [(row["type"], row["i"], assets[row["s"]], row["n"], row["p"], row["t"]) for row in params]
+    )
+    return {row["i"] for row in params}
+
+
+def recompute(db, user_ids):
+    """Rebuild holdings and cash of the given users from their whole trade log"""
+    if not user_ids:
+        return
+    db.execute(text('CREATE TEMP TABLE IF NOT EXISTS import_user (id INTEGER PRIMARY KEY)'))
+    db.execute(text('DELETE FROM import_user'))
+    db.execute(text('INSERT INTO import_user (id) VALUES (:i)'), [{"i": i} for i in user_ids])
+
+    # quantities set in place, so holdings with no trades (watch list) stay
+    db.execute(text(
+        '''
+        INSERT INTO holding (asset_id, user_id, qty, basis, realized)
+        SELECT asset_id, user_id, total(CASE type WHEN 'buy' THEN qty ELSE -qty END), 0, 0
+        FROM trade
+        WHERE user_id IN (SELECT id FROM import_user)
+        GROUP BY user_id, asset_id
+        ON CONFLICT (asset_id, user_id) DO UPDATE SET qty = excluded.qty
+        '''
+    ))
+    db.execute(text(
+        '''
+        UPDATE user SET cash = :c - (
+            SELECT total(CASE type WHEN 'buy' THEN qty * price ELSE -qty * price END)
+            FROM trade WHERE trade.user_id = user.id
+        )
+        WHERE id IN (SELECT id FROM import_user)
+        '''), {"c": default_cash}
+    )
+
+    # average cost depends on trade order, see finance.costbasis
+    costbasis.backfill(db, users="import_user")
+    leaderboard.update_users(db, "import_user")
+    db.execute(text('DROP TABLE import_user'))
+
+
+# Add cli command
+@click.command("import-trades")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--assets", "assets_path", type=click.Path(exists=True, dir_okay=False),
+    help="Assets file (symbol, name, price, cls) to load first.")
+@click.option("--format", type=click.Choice(["csv", "ndjson"]), default=None,
+    help="File format, by default from the extension.")
+@click.option("--chunk", default=50_000, help="Rows per transaction.")
+def import_trades_command(path, assets_path, format, chunk):
+    """Import trades (username or user_id, symbol, type, qty, price, time)"""
+    start = time.perf_counter()
+
+    if assets_path:
+        n = 0
+        for rows in chunks(read(assets_path, format), chunk):
+            with Session() as db:
+                n += import_assets(db, rows)
+                db.commit()
+        # new prices change the value of every holder, not only imported users
+        with Session() as db:
+            leaderboard.rebuild(db)
+            db.commit()
+        click.echo(f"Upserted {n} assets.")
+
+    with Session() as db:
+        assets = dict(db.execute(text('SELECT symbol, id FROM asset')).all())
+        users = dict(db.execute(text('SELECT username, id FROM user')).all())
+    ids = set(users.values())
+
+    n = skipped = 0
+    touched = set()
+    for c, rows in enumerate(chunks(read(path, format), chunk)):
+        params = []
+        for i, row in enumerate(rows):
+            try:
+                params.append(parse(row, users, ids))
+            except ValueError as e:
+                skipped += 1
+                if skipped <= 10:
+                    click.echo(f"row {c * chunk + i + 1}: {e}", err=True)
+        if params:
+            with Session() as db:
+                touched |= import_trades(db, params, assets)
+                db.commit()
+        n += len(params)
+
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Imported {n} trades for {len(touched)} users, skipped {skipped}, "
+        f"in {elapsed:.1f}s ({n / elapsed:,.0f} rows/s)."
+    )
+
+    start = time.perf_counter()
+    with Session() as db:
+        recompute(db, touched)
+        db.commit()
+    click.echo(f"Recomputed holdings and cash in {time.perf_counter() - start:.1f}s.")
+
+
+def init_app(app):
+    app.cli.add_command(import_trades_command)
@@ -0,0 +1,95 @@
+import click
+from sqlalchemy import bindparam, text
+
+from finance import caching
+from finance.db import Session
+
+
+# Largest holding and total asset value (ex-cash) for every user in one grouped pass.
+# sqlite fills the bare `symbol` column from the row that produced max(), see
+# https://www.sqlite.org/lang_select.html#bareagg
+ranks = '''
+    SELECT user.id AS user_id, user.username AS name, asset.symbol AS symbol,
+        max(holding.qty * asset.price) AS top,
+        coalesce(sum(holding.qty * asset.price), 0) AS sum
+    FROM user
+    LEFT JOIN holding ON holding.user_id = user.id AND holding.qty > 0
+    LEFT JOIN asset ON holding.asset_id = asset.id
+    {where}
+    GROUP BY user.id
+'''
+
+# Upsert computed ranks into the leaderboard table
+# (WHERE true avoids the sqlite parsing ambiguity between a join and ON CONFLICT)
+upsert = '''
+    INSERT INTO leaderboard (user_id, name, symbol, sum)
+    SELECT user_id, name, symbol, sum FROM ({ranks}) WHERE true
+    ON CONFLICT (user_id) DO UPDATE SET
+        name = excluded.name,
+        symbol = excluded.symbol,
+        sum = excluded.sum
+'''
+
+
+def rebuild(db):
+    """Recompute the whole leaderboard table"""
+    db.execute(text('DELETE FROM leaderboard'))
+    db.execute(text(upsert.format(ranks=ranks.format(where=''))))
+    caching.bump(db, "leaderboard")
+
+
+def update_user(db, user_id):
+    """Refresh the leaderboard row of one user, e.g. after a trade"""
+    db.execute(text(upsert.format(
+        ranks=ranks.format(where='WHERE user.id = :i')
+    )), {"i": user_id})
+    caching.bump(db, "leaderboard")
+
+
+def update_users(db, users):
+    """Refresh the leaderboard rows of the users in a table of user ids (column id)"""
+    db.execute(text(upsert.format(
+        ranks=ranks.format(where=f'WHERE user.id IN (SELECT id FROM {users})')
+    )))
+    caching.bump(db, "leaderboard")
+
+
+def update_asset(db, asset_id):
+    """Refresh the leaderboard rows of every holder of an asset, e.g. after a price change"""
+    db.execute(text(upsert.format(
+        ranks=ranks.format(where='WHERE user.id IN (SELECT user_id FROM holding WHERE asset_id = :a)')
+    )), {"a": asset_id})
+    caching.bump(db, "leaderboard")
+
+
+def update_assets(db, asset_ids):
+    """Refresh the leaderboard rows of every holder of any of these assets"""
+    db.execute(text(upsert.format(
+        ranks=ranks.format(where='WHERE user.id IN (SELECT user_id FROM holding WHERE asset_id IN :a)')
+    )).bindparams(bindparam("a", expanding=True)), {"a": list(asset_ids)})
+    caching.bump(db, "leaderboard")
+
+
+def page(db, limit, offset=0):
+    """Return one page of leaderboard rows ordered by portfolio value"""
+    return db.execute(text(
+        '''
+        SELECT user_id, name, coalesce(symbol, 'None') AS symbol, sum
+        FROM leaderboard
+        ORDER BY sum DESC
+        LIMIT :n OFFSET :o
+        '''), {"n": limit, "o": offset}
+    ).all()
+
+
+# Add cli command
+@click.command("rebuild-leaderboard")
+def rebuild_leaderboard_command():
+    with Session() as db:
+        rebuild(db)
+        db.commit()
+    click.echo("Leaderboard rebuilt.")
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_leaderboard_command)
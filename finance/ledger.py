@@ -0,0 +1,273 @@
+import itertools
+import time
+from collections import defaultdict
+from operator import itemgetter
+
+import click
+from sqlalchemy import text
+
+from finance import costbasis, leaderboard
+from finance.db import Session
+from finance.model import default_cash
+
+
+# user.cash and holding.qty are running totals of the trade log. A replay
+# streams trade ordered by (user_id, time) alongside user, holding and the
+# last snapshot, all sorted by user id, so it holds one user's positions at
+# a time however long the log is. Cash and quantities are plain sums: the
+# state of a snapshot taken at trade id N plus the trades after N equals a
+# replay of the whole log.
+
+# Differences below this are float noise
+tolerance = 1e-6
+
+# Rows fetched per round trip while streaming
+fetch = 5000
+
+# From the start the (user_id, time) index gives the order with no sort
+# ("+id" keeps the planner off the rowid range); after a snapshot the few
+# newer trades are found by id and sorted
+trades_sql = '''
+    SELECT user_id, asset_id, type, qty, price FROM trade
+    WHERE user_id IS NOT NULL AND {id} > :lo AND {id} <= :hi
+    ORDER BY user_id, time, id
+'''
+
+
+class Stream:
+    """Rows sorted by user id (first column), taken one user at a time"""
+
+    def __init__(self, rows):
+        self.groups = itertools.groupby(rows, key=itemgetter(0))
+        self.taken = False
+        self.advance()
+
+    def advance(self):
+        self.key, self.rows = next(self.groups, (None, ()))
+
+    def take(self, user_id):
+        """Iterate the rows of user_id, skipping lower ids (rows of deleted users)"""
+        if self.taken:
+            self.advance()
+            self.taken = False
+        while self.key is not None and self.key < user_id:
+            self.advance()
+        if self.key != user_id:
+            return ()
+        self.taken = True
+        return self.rows
+
+
+class Writer:
+    """Buffer executemany parameters per statement, one transaction per `size` rows"""
+
+    def __init__(self, size):
+        self.size = size
+        self.pending = defaultdict(list)
+        self.n = 0
+        self.changed = 0    # rows the flushed statements changed
+
+    def add(self, statement, params):
+        self.pending[statement].append(params)
+        self.n += 1
+        if self.n >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with Session() as db:
+                for statement, rows in self.pending.items():
+                    self.changed += db.execute(text(statement), rows).rowcount
+                db.commit()
+        self.pending.clear()
+        self.n = 0
+
+
+def latest(db):
+    """Return the newest snapshot row (id, trade_id, time), or None"""
+    return db.execute(text('SELECT id, trade_id, time FROM snapshot ORDER BY id DESC LIMIT 1')).first()
+
+
+def replay(db, since=None, upto=None):
+    """Yield (user_id, cash, holdings, ledger_cash, ledger_holdings, trades) per user, in id order
+
+    cash and holdings {asset_id: qty} are the stored values, ledger_* what
+    the log implies: default_cash and no positions plus every trade up to
+    id `upto`, or snapshot `since` plus the trades after it. Every stream is
+    read in the caller's transaction so they agree with each other.
+    """
+    options = {"yield_per": fetch}
+    snapshot_id = since.id if since is not None else None
+
+    users = db.execute(text('SELECT id, cash FROM user ORDER BY id'), execution_options=options)
+    holdings = Stream(db.execute(text(
+        'SELECT user_id, asset_id, qty FROM holding WHERE user_id IS NOT NULL ORDER BY user_id'
+        ), execution_options=options
+    ))
+    trades = Stream(db.execute(
+        text(trades_sql.format(id="+id" if since is None else "id")),
+        {"lo": since.trade_id if since is not None else 0, "hi": upto},
+        execution_options=options,
+    ))
+    base_cash = Stream(db.execute(text(
+        'SELECT user_id, cash FROM snapshot_cash WHERE snapshot_id = :s ORDER BY user_id'
+        ), {"s": snapshot_id}, execution_options=options
+    ))
+    base_holdings = Stream(db.execute(text(
+        'SELECT user_id, asset_id, qty FROM snapshot_holding WHERE snapshot_id = :s ORDER BY user_id'
+        ), {"s": snapshot_id}, execution_options=options
+    ))
+
+    for user_id, cash in users:
+        ledger_cash = default_cash
+        for _, ledger_cash in base_cash.take(user_id):
+            pass
+        ledger = defaultdict(float)
+        for _, asset_id, qty in base_holdings.take(user_id):
+            ledger[asset_id] = qty
+
+        n = 0
+        for _, asset_id, type, qty, price in trades.take(user_id):
+            if type == 'buy':
+                ledger[asset_id] += qty
+                ledger_cash -= qty * price
+            else:
+                ledger[asset_id] -= qty
+                ledger_cash += qty * price
+            n += 1
+
+        stored = {asset_id: qty for _, asset_id, qty in holdings.take(user_id)}
+        yield user_id, cash, stored, ledger_cash, ledger, n
+
+
+def differences(cash, holdings, ledger_cash, ledger):
+    """Return (cash differs, [(asset_id, stored qty or None, ledger qty)])"""
+    assets = sorted(holdings.keys() | ledger.keys())
+    return abs(cash - ledger_cash) > tolerance, [
+        (asset_id, holdings.get(asset_id), ledger.get(asset_id, 0))
+        for asset_id in assets
+        if abs((holdings.get(asset_id) or 0) - ledger.get(asset_id, 0)) > tolerance
+    ]
+
+
+# Add cli command
+@click.command("replay-ledger")
+@click.option("--repair", is_flag=True, help="Set cash and holdings to what the trade log implies.")
+@click.option("--snapshot", is_flag=True, help="Save the replayed state; later replays start from it.")
+@click.option("--full", is_flag=True, help="Replay the whole log, ignoring the last snapshot.")
+@click.option("--batch", default=5000, help="Rows per repair or snapshot transaction.")
+@click.option("--show", default=20, help="Differences to print.")
+def replay_ledger_command(repair, snapshot, full, batch, show):
+    """Recompute cash and holdings from the trade log, report or repair differences"""
+    start = time.perf_counter()
+    fixes = Writer(batch)
+    saved = Writer(batch)
+    users = trades = cash_diffs = holding_diffs = 0
+
+    with Session() as db:
+        # One read transaction: the log, the stored totals and the snapshot
+        # are all seen as of the same commit, whatever is written meanwhile
+        db.connection().exec_driver_sql("BEGIN")
+        since = None if full else latest(db)
+        upto = db.execute(text('SELECT coalesce(max(id), 0) FROM trade')).scalar()
+        last_job = db.execute(text('SELECT coalesce(max(id), 0) FROM job')).scalar()
+        snapshot_id = db.execute(text('SELECT coalesce(max(id), 0) + 1 FROM snapshot')).scalar()
+        if since is not None and upto < since.trade_id:
+            # trades it summarizes were deleted and their ids may be reused
+            raise click.ClickException(
+                f"the trade log is behind snapshot {since.id} (trade {since.trade_id}); replay with --full"
+            )
+        if snapshot:
+            # rows left by an interrupted snapshot
+            saved.add('DELETE FROM snapshot_cash WHERE snapshot_id >= :s', {"s": snapshot_id})
+            saved.add('DELETE FROM snapshot_holding WHERE snapshot_id >= :s', {"s": snapshot_id})
+
+        for user_id, cash, holdings, ledger_cash, ledger, n in replay(db, since, upto):
+            users += 1
+            trades += n
+
+            cash_differs, diffs = differences(cash, holdings, ledger_cash, ledger)
+            if cash_differs:
+                cash_diffs += 1
+                if cash_diffs + holding_diffs <= show:
+                    click.echo(f"user {user_id}: cash {cash:.2f}, ledger {ledger_cash:.2f}")
+                if repair:
+                    fixes.add(
+                        'UPDATE user SET cash = :c WHERE id = :i AND cash = :c0',
+                        {"c": ledger_cash, "i": user_id, "c0": cash},
+                    )
+            for asset_id, qty, ledger_qty in diffs:
+                holding_diffs += 1
+                if cash_diffs + holding_diffs <= show:
+                    click.echo(f"user {user_id} asset {asset_id}: qty {qty}, ledger {ledger_qty:g}")
+                if not repair:
+                    continue
+                # conditional on the values read, so a trade committed since is never undone
+                if qty is None:
+                    fixes.add(
+                        '''
+                        INSERT INTO holding (asset_id, user_id, qty, basis, realized)
+                        VALUES (:a, :i, :q, 0, 0)
+                        ON CONFLICT (asset_id, user_id) DO NOTHING
+                        ''', {"a": asset_id, "i": user_id, "q": ledger_qty}
+                    )
+                else:
+                    fixes.add(
+                        'UPDATE holding SET qty = :q WHERE user_id = :i AND asset_id = :a AND qty = :q0',
+                        {"q": ledger_qty, "i": user_id, "a": asset_id, "q0": qty},
+                    )
+
+            if snapshot and (n or ledger_cash != default_cash or ledger):
+                saved.add(
+                    'INSERT INTO snapshot_cash (snapshot_id, user_id, cash) VALUES (:s, :i, :c)',
+                    {"s": snapshot_id, "i": user_id, "c": ledger_cash},
+                )
+                for asset_id, qty in ledger.items():
+                    if abs(qty) > tolerance:
+                        saved.add(
+                            '''
+                            INSERT INTO snapshot_holding (snapshot_id, user_id, asset_id, qty)
+                            VALUES (:s, :i, :a, :q)
+                            ''', {"s": snapshot_id, "i": user_id, "a": asset_id, "q": qty}
+                        )
+        db.rollback()
+
+    origin = f"snapshot {since.id} ({since.time})" if since is not None else "the start"
+    click.echo(
+        f"Replayed {trades} trades of {users} users from {origin} in {time.perf_counter() - start:.1f}s: "
+        f"{cash_diffs} cash and {holding_diffs} holding differences."
+    )
+
+    if repair and (cash_diffs or holding_diffs):
+        fixes.flush()
+        with Session() as db:
+            if holding_diffs:
+                costbasis.backfill(db)
+            leaderboard.rebuild(db)
+            db.commit()
+        skipped = cash_diffs + holding_diffs - fixes.changed
+        click.echo(f"Repaired {fixes.changed}" + (f", {skipped} changed meanwhile" if skipped else "") + ".")
+
+    if snapshot:
+        saved.flush()
+        with Session() as db:
+            # a reset since the replay began deleted trades this state still counts
+            reset = db.execute(text(
+                "SELECT id FROM job WHERE kind = 'reset' AND (state = 'running' OR id > :j)"
+                ), {"j": last_job}
+            ).first()
+            if reset is not None:
+                click.echo("Snapshot discarded: a reset ran during the replay.")
+                return
+            db.execute(text(
+                'INSERT INTO snapshot (id, trade_id) VALUES (:s, :t)'), {"s": snapshot_id, "t": upto}
+            )
+            db.execute(text('DELETE FROM snapshot_cash WHERE snapshot_id < :s'), {"s": snapshot_id})
+            db.execute(text('DELETE FROM snapshot_holding WHERE snapshot_id < :s'), {"s": snapshot_id})
+            db.execute(text('DELETE FROM snapshot WHERE id < :s'), {"s": snapshot_id})
+            db.commit()
+        click.echo(f"Saved snapshot {snapshot_id} at trade {upto}.")
+
+
+def init_app(app):
+    app.cli.add_command(replay_ledger_command)
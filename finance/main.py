@@ -1,14 +1,13 @@
-import time
-
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    current_app, Blueprint, flash, g, jsonify, redirect, render_template, request, session, url_for
 )
 from sqlalchemy import select, text
 
+from finance import achievements, book, gateway, leaderboard, orders, prefs, prices, reset
+from finance import search as asset_search
 from finance.auth import login_required
-from finance.db import Session
-from finance.helpers import lookup, usd
-from finance.model import User, Asset, Hodl, Trade, Skull
+from finance.db import Session, usd
+from finance.model import User, Asset, Hodl, Skull
 
 bp = Blueprint("main", __name__)
 
@@ -19,6 +18,7 @@ def index():
         
     user_id = g.user["id"]
     asset_val = 0
+    pnl = 0
     holdings = []    
 
     # Portfolio view
@@ -37,148 +37,155 @@ def index():
         for row in cur.execute(sel).all():
             if row is not None:
                 asset_val += (row.qty * row.price)
+                pnl += (row.qty * row.price - row.basis)
                 holdings.append(row)
-        
-        # Set theme preference
-        theme = cur.execute(text(
-            'SELECT theme FROM settings WHERE user_id = :i'
-            ), {"i": user_id}
-        ).scalar()
-
-    if theme == 'dark':
-        session["theme"] = 'dark' 
-    elif theme == 'auto':
-        hr = time.localtime().tm_hour
-        session["theme"] = 'dark' if hr > 18 or hr < 7 else None            
-    else:
-        session["theme"] = None
+
+    # Set theme preference - cached in the session since login
+    session["theme"] = prefs.resolve_theme(prefs.get("theme"))
     
     total = (cash + asset_val)
 
-    return render_template("index.html", holdings=holdings, cash=cash, asset_val=asset_val, total=total)
+    return render_template("index.html", holdings=holdings, cash=cash, asset_val=asset_val, pnl=pnl, total=total)
     
 
 @bp.route("/trade", methods=["GET", "POST"])
 @login_required
-def trade():
+async def trade():
     
     # POST
     if request.method == "POST":
         user_id = g.user["id"]
         symbol = request.form.get("symbol").upper()
-        shares = int(request.form.get("shares"))
         view = request.form.get("view")
         type = request.form.get("type")
-        badges = get_badges()
-        events = []     # listen for achievement events
+        try:
+            shares = int(request.form.get("shares"))
+        except (TypeError, ValueError):
+            shares = 0
+        if shares < 1:
+            flash("invalid order")
+            return redirect(url_for(view))
 
-        # Fetch quote
-        asset_id = None
-        quote = lookup(symbol)
+        # Fetch quote, without holding the worker past QUOTE_TIMEOUT
+        quote = await gateway.fetch(symbol, max_age=current_app.config["QUOTE_TRADE_MAX_AGE"])
         if quote is None:
             flash("None")
             return redirect(url_for(view))
-        price = quote["price"]
-        name = quote["name"]
-        val = (shares * price)
 
-        # Get user inventory
-        qty = 0
+        # Update tables: asset, holding, user, trade - in one transaction
         with Session() as db:
-            u = db.get(User, user_id)
-            cash = u.cash
-            a = db.execute(select(Asset).where(Asset.symbol == symbol)).scalar()
-            if a is not None:
-                asset_id = a.id
-                h = db.get(Hodl, (asset_id,user_id))
-                if h is not None:
-                    qty = h.qty
-        
-        # buy
-        error = None
-        if type == 'buy':
-            if val > cash:
-                error = "rejected low cash"
-            cash -= val
-            qty += shares
-
-        # sell
-        else:
-            if qty == 0:
-                error = "you don't own it"
-            elif shares > qty:
-                error = "rejected low inventory"
-            else:
-                profit = is_profit(asset_id, val, qty)
-                cash += val
-                qty -= shares
-
-        if error is not None:
-            flash(error)
-            return redirect(url_for(view))
-        
-        # Update tables: asset, holding, user, trade
-        with Session() as db:
-            if asset_id is None:
-                db.add(
-                    Asset(symbol=symbol, name=name, price=price)
-                )
-                a = db.execute(select(Asset).where(Asset.symbol == symbol))
-                asset_id = a.id
-            else:
-                a = db.get(Asset, asset_id)
-                a.price = price           
-
-            h = db.get(Hodl, (asset_id,user_id))
-            if h is None:
-                db.add(
-                    Hodl(asset_id=asset_id, user_id=user_id, qty=qty)
-                )
-            else:
-                h.qty = qty
-
-            u = db.get(User, user_id)
-            u.cash = cash
-
-            db.add(
-                Trade(type=type, user_id=user_id, asset_id=asset_id, qty=shares, price=price)
-            )
+            try:
+                fill = orders.execute(db, user_id, type, symbol, quote["name"], quote["price"], shares)
+            except orders.Rejected as e:
+                db.rollback()
+                flash(str(e))
+                return redirect(url_for(view))
             db.commit()
+        book.on_price({symbol: quote["price"]})
         
         flash("done")
         
         # Tally achievements
-        if 1 not in badges:     # s1: make a trade
-            events.append(1)
-        if view == 'index' and 2 not in badges:     # s2: no time wasted
-            events.append(2)
-        if type == 'sell' and profit == True and 4 not in badges:    # s4: profiteer 
-            events.append(4)
-        if shares > 999 and 5 not in badges:    # s5: big bags
-            events.append(5)
-        if len(events) > 1 and 3 not in badges:     # s3: two-fer
-            events.append(3)
-        if len(events) > 0:
-            new_badges = add_badges(events)
-            for name in new_badges:
-                flash(f"Achievement: {name}")
+        event = achievements.TradeEvent(type=type, shares=shares, view=view, profit=fill.profit)
+        for name in achievements.award(user_id, event):
+            flash(f"Achievement: {name}")
 
         return redirect(url_for("index"))
     
     # GET
-    return render_template("trade.html")
+    with Session() as db:
+        open_orders = book.open_orders(db, g.user["id"])
+    return render_template("trade.html", orders=open_orders)
+
+
+@bp.route("/order", methods=["POST"])
+@login_required
+async def order():
+    """Place a limit order; it fills once the market price crosses the limit"""
+    user_id = g.user["id"]
+    symbol = request.form.get("symbol", "").upper()
+    type = request.form.get("type")
+    try:
+        shares = int(request.form.get("shares"))
+        limit = float(request.form.get("limit"))
+    except (TypeError, ValueError):
+        shares = limit = 0
+    if type not in ("buy", "sell") or shares <= 0 or limit <= 0:
+        flash("invalid order")
+        return redirect(url_for("main.trade"))
+
+    # a marketable order fills at this price, so it must be as fresh as a trade's
+    quote = await gateway.fetch(symbol, max_age=current_app.config["QUOTE_TRADE_MAX_AGE"])
+    if quote is None:
+        flash("None")
+        return redirect(url_for("main.trade"))
+
+    with Session() as db:
+        book.place(db, user_id, type, symbol, quote["name"], quote["price"], shares, limit)
+        db.commit()
+
+    # Marketable on arrival: fills right away at the quoted price
+    book.on_price({symbol: quote["price"]})
+
+    flash(f"{type} {shares} {symbol} at {usd(limit)} placed")
+    return redirect(url_for("main.trade"))
+
+
+@bp.route("/order/<int:order_id>/cancel", methods=["POST"])
+@login_required
+def cancel_order(order_id):
+    """Cancel one of the user's open orders"""
+    with Session() as db:
+        cancelled = book.cancel(db, g.user["id"], order_id)
+        db.commit()
+    flash("cancelled" if cancelled else "order is no longer open")
+    return redirect(url_for("main.trade"))
+
+
+@bp.route("/trade/batch", methods=["POST"])
+@login_required
+async def trade_batch():
+    """Execute a basket of market orders posted as JSON
+
+    Request: {"orders": [{"symbol": "AAPL", "shares": 10, "type": "buy"}, ...]}
+    Response: {"results": [one status per order], "cash": cash after}
+    """
+    body = request.get_json(silent=True)
+    legs = body.get("orders") if isinstance(body, dict) else None
+    if not isinstance(legs, list) or not legs:
+        return jsonify(error="expected a list of orders"), 400
+    if len(legs) > current_app.config["BATCH_MAX_ORDERS"]:
+        return jsonify(error="too many orders"), 400
+    if not all(isinstance(leg, dict) for leg in legs):
+        return jsonify(error="expected a list of orders"), 400
+
+    # Every symbol in the basket looked up concurrently
+    symbols = sorted({str(leg.get("symbol") or "").upper() for leg in legs} - {""})
+    quotes = await gateway.fetch_many(symbols, max_age=current_app.config["QUOTE_TRADE_MAX_AGE"])
+
+    with Session() as db:
+        try:
+            results, cash = orders.execute_batch(db, g.user["id"], legs, quotes)
+        except orders.Rejected as e:
+            db.rollback()
+            return jsonify(error=str(e)), 409
+        db.commit()
+    book.on_price({symbol: q["price"] for symbol, q in quotes.items() if q is not None})
+
+    return jsonify(results=results, cash=cash)
 
 
 @bp.route("/quote", methods=["POST"])
 @login_required
-def quote():
+async def quote():
     
     if request.method == "POST":
         user_id = g.user["id"]
         
         # Lookup
         symbol = request.form.get("symbol").upper()
-        quote = lookup(symbol)
+        # the price also fills resting orders, see book.on_price
+        quote = await gateway.fetch(symbol, max_age=current_app.config["QUOTE_TRADE_MAX_AGE"])
         if quote is not None:
             name = quote["name"]
             price = quote["price"]
@@ -193,6 +200,7 @@ def quote():
                         Asset(symbol=symbol, name=name, price=price)
                     )
                     a = db.execute(select(Asset).where(Asset.symbol == symbol)).scalar()
+                    asset_search.invalidate()
                 else:
                     a.price = price
                 
@@ -202,7 +210,11 @@ def quote():
                     db.add(
                         Hodl(asset_id=a.id, user_id=user_id, qty=0)
                     )
+                db.flush()
+                prices.record(db, [(symbol, price)])
+                leaderboard.update_asset(db, a.id)
                 db.commit()
+            book.on_price({symbol: price})
             
             flash("Found: {} ${}".format(symbol, usd(price)))
             return redirect("/")
@@ -247,24 +259,13 @@ def unwatch():
 @login_required
 def search():
     """Handle a request for database records"""
-    # search assets for exact symbol or name like
-    # return 1 row w symbol, name
-        
-    s = request.args.get("q").upper()
-    if s is None or s == '':
-        row = None
-    else:
-        with Session() as db:
-            row = db.execute(text(
-                '''
-                SELECT * FROM asset 
-                WHERE symbol =:sym OR name LIKE :nam
-                '''), {
-                    "sym": s,
-                    "nam": '%' + s + '%'
-                }).first()
+    # ranked symbol/name prefix matches, see finance.search
+
+    s = request.args.get("q", "")
+    with Session() as db:
+        rows = asset_search.search(db, s, k=current_app.config["SEARCH_LIMIT"])
     
-    return render_template("search.html", row=row)
+    return render_template("search.html", rows=rows)
 
 
 @bp.route("/settings", methods=["GET", "POST"])
@@ -272,118 +273,53 @@ def search():
 def settings():
     
     if request.method == "POST":
-        default_cash = 1_000_000
-        theme =  request.form.get("theme")
-        if theme is not None:
+        values = {name: request.form[name] for name in prefs.fields if name in request.form}
+        if values:
             
-            # Set theme
-            with Session() as db:
-                db.execute(text('UPDATE settings SET theme =:s WHERE user_id =:i'),
-                    {"s": theme, "i": g.user["id"]}
-                )
-                db.commit()
-           
-            if theme == 'dark':
-                session["theme"] = 'dark' 
-            elif theme == 'auto':
-                hr = time.localtime().tm_hour
-                session["theme"] = 'dark' if hr > 18 or hr < 7 else None
-            else:
-                session["theme"] = None
+            # Set preferences
+            prefs.update(g.user["id"], **values)
+            session["theme"] = prefs.resolve_theme(prefs.get("theme"))
 
             return redirect(url_for("main.settings"))
         
         # reset one - tables: trade, holding, badge, user
+        # runs in the background in small batches, see finance.reset
         elif request.form.get("reset") == "me":
-            user_id = g.user["id"]
-            with Session() as db:
-                db.execute(text('delete from trade where user_id =:i'), {"i": user_id})
-                db.execute(text('delete from holding where user_id =:i'), {"i": user_id})
-                db.execute(text('delete from badge where user_id =:i'), {"i": user_id})
-                u = db.get(User, user_id)
-                u.cash = default_cash
-                db.commit()
+            job_id = reset.start(current_app._get_current_object(), g.user["id"])
+            session["badges"] = 0
         
         # reset all
         elif request.form.get("reset") == "all":
-            with Session() as db:
-                db.execute(text('delete from trade'))
-                db.execute(text('delete from holding'))
-                db.execute(text('delete from badge'))
-                db.execute(text('update user set cash = :i'), {"i": default_cash})
-                db.commit()
-            
-        return redirect(url_for("index"))
+            job_id = reset.start(current_app._get_current_object())
+            session["badges"] = 0
+
+        else:
+            return redirect(url_for("main.settings"))
+
+        if job_id is None:
+            flash("a reset is already running")
+        else:
+            session["reset_job"] = job_id
+            flash("reset started")
+        return redirect(url_for("main.settings"))
 
     # GET
-    user_id = g.user["id"]
-    badges = get_badges()
+    job = reset.status(session["reset_job"]) if "reset_job" in session else None
+    if job is not None and job.state != 'running':
+        session.pop("reset_job")
+    badges = achievements.ids(achievements.earned())
     with Session() as db:
         unlockables = db.execute(select(Skull)).scalars().all()
     
-    return render_template("settings.html", badges=badges, unlockables=unlockables)
-
-
-def get_badges():
-    """Return a list of achievement id, given user id"""
-
-    badges = []
-    with Session() as db:
-        u = db.get(User, g.user["id"])
-        for skull in u.badges:
-            badges.append(skull.id)
-    return badges
-
-
-def add_badges(events):
-    """Add earned achievements to user badge collection"""
-    # return a list of achievement names to display to user    
-    # For each skull id passed in by events, we get a skull object from the ORM
-    # and append it to the user collection. On commit, an automatic INSERT to the 
-    # badge table is emitted with the combined (skull,user) foreign keys
-    names = []
-    with Session() as db:
-        u = db.get(User, g.user["id"])
-        for skull_id in events:
-            skull = db.get(Skull, skull_id)
-            u.badges.append(skull)
-            names.append(skull.name)
-        db.commit()
-        
-    return names
+    return render_template("settings.html", badges=badges, unlockables=unlockables, job=job)
 
 
-def is_profit(asset_id, value, qty):
-    """Return True if proceeds from sale exceeds cash outlay"""
-    # param: asset, 
-    # param: this sale value, 
-    # param: prev qty owned    
+@bp.route("/settings/reset/<int:job_id>", methods=["GET"])
+@login_required
+def reset_status(job_id):
+    """Progress of the reset job this session started, as JSON"""
 
-    # profit is True if this trade val > outlay of current holdings
-    
-    # Query all trades of this symbol
-    with Session() as db:
-        sel = text(
-            '''
-            SELECT * from trade
-            WHERE trade.asset_id = :a
-            AND trade.user_id = :i
-            ORDER BY time DESC
-            '''
-        ).bindparams(a=asset_id, i=g.user["id"])
-
-        # Crunch value spent
-        owned = 0
-        spent = 0
-        for row in db.execute(sel).all():
-            val = row.price * row.qty
-            if row.type == 'buy':
-                owned += row.qty
-                spent += val
-            else:
-                owned -= row.qty
-                spent -= val
-            if owned == qty:
-                break
-
-    return (value > spent)
\ No newline at end of file
+    job = reset.status(job_id) if job_id == session.get("reset_job") else None
+    if job is None:
+        return jsonify(error="no such job"), 404
+    return jsonify(state=job.state, done=job.done, total=job.total)
\ No newline at end of file
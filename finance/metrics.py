@@ -0,0 +1,176 @@
+import bisect
+import hmac
+import logging
+import os
+import threading
+import time
+
+from flask import abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from finance.db import Session
+
+
+# Statements slower than SLOW_QUERY_MS are logged here; the hooks are per
+# engine, not per app, so the threshold is process-wide
+slow_log = logging.getLogger("finance.sql.slow")
+slow_query_ms = None
+
+# Upper bounds of the latency histogram buckets, in seconds
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)     # last = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, n in zip(buckets + ("+Inf",), self.counts):
+            total += n
+            yield le, total
+
+
+# SQLAlchemy cursor hooks, process-wide per engine. Per-request totals
+# live on g; statements run outside a request only feed the slow log.
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context():
+        g.sql_count = g.get("sql_count", 0) + 1
+        g.sql_time = g.get("sql_time", 0.0) + elapsed
+
+    if slow_query_ms is not None and elapsed * 1000 >= slow_query_ms:
+        slow_log.warning(
+            "%.1f ms%s: %s %r", elapsed * 1000, " (executemany)" if executemany else "",
+            " ".join(statement.split()), parameters if not executemany else parameters[:1]
+        )
+        if has_request_context():
+            g.sql_slow = g.get("sql_slow", 0) + 1
+
+
+def instrument(engine):
+    """Attach the cursor hooks to an engine, once"""
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+def server_timing(response):
+    """Add a Server-Timing header with the request's db and app time"""
+    start = g.get("request_start")
+    if start is not None and current_app.config["SERVER_TIMING"]:
+        elapsed = time.perf_counter() - start
+        response.headers["Server-Timing"] = (
+            f'db;dur={g.get("sql_time", 0.0) * 1000:.1f};desc="{g.get("sql_count", 0)} queries", '
+            f'app;dur={elapsed * 1000:.1f}'
+        )
+    return response
+
+
+def record(exc=None):
+    """Fold the request into the endpoint metrics, whether it returned or raised"""
+    start = g.pop("request_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    count, db_time = g.get("sql_count", 0), g.get("sql_time", 0.0)
+
+    endpoint = request.endpoint or "unmatched"
+    if endpoint == "static" or endpoint == "metrics":
+        return
+    m = current_app.extensions["metrics"]
+    with m["lock"]:
+        if endpoint not in m["latency"]:
+            m["latency"][endpoint] = Histogram()
+            m["db"][endpoint] = [0, 0.0, 0]
+        m["latency"][endpoint].observe(elapsed)
+        totals = m["db"][endpoint]
+        totals[0] += count
+        totals[1] += db_time
+        totals[2] += g.get("sql_slow", 0)
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format"""
+    m = current_app.extensions["metrics"]
+    lines = [
+        "# HELP finance_request_duration_seconds Request latency by endpoint.",
+        "# TYPE finance_request_duration_seconds histogram",
+    ]
+    with m["lock"]:
+        latency = {k: (list(h.cumulative()), h.sum, h.count) for k, h in m["latency"].items()}
+        db = {k: list(v) for k, v in m["db"].items()}
+
+    for endpoint, (cumulative, total, count) in sorted(latency.items()):
+        for le, n in cumulative:
+            lines.append(f'finance_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {n}')
+        lines.append(f'finance_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total}')
+        lines.append(f'finance_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}')
+
+    for name, i, help in (
+        ("finance_db_queries_total", 0, "SQL statements executed, by endpoint."),
+        ("finance_db_seconds_total", 1, "Time spent in SQL statements, by endpoint."),
+        ("finance_db_slow_queries_total", 2, "Statements over SLOW_QUERY_MS, by endpoint."),
+    ):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+        for endpoint, totals in sorted(db.items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {totals[i]}')
+
+    lines.append("# HELP finance_cache_events_total Process cache lookups by outcome.")
+    lines.append("# TYPE finance_cache_events_total counter")
+    for cache in ("quotes", "search", "performance"):
+        stats = current_app.extensions[cache].stats()
+        for outcome in ("hits", "misses", "coalesced"):
+            lines.append(f'finance_cache_events_total{{cache="{cache}",outcome="{outcome}"}} {stats[outcome]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        abort(403)
+    return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def init_app(app):
+    global slow_query_ms
+    slow_query_ms = app.config["SLOW_QUERY_MS"]
+    instrument(Session.kw["bind"])
+
+    # Slow-query log file, one handler per path however many apps are created
+    if app.config["SLOW_QUERY_LOG"]:
+        path = os.path.join(app.instance_path, app.config["SLOW_QUERY_LOG"])
+        if not any(getattr(h, "baseFilename", None) == path for h in slow_log.handlers):
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            slow_log.addHandler(handler)
+            slow_log.setLevel(logging.WARNING)
+
+    app.extensions["metrics"] = {"lock": threading.Lock(), "latency": {}, "db": {}}
+    app.before_request(start_timer)
+    app.after_request(server_timing)
+    app.teardown_request(record)
+
+    # Register the Prometheus endpoint
+    if app.config["METRICS"]:
+        app.add_url_rule("/metrics", endpoint="metrics", view_func=metrics)
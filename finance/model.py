@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Float, ForeignKey, func, Integer, String, Table, TIMESTAMP
+    Column, DDL, event, Float, ForeignKey, func, Index, Integer, String, Table, TIMESTAMP
 )
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped, relationship
@@ -18,7 +18,8 @@ user = Table(
     Column("id", Integer, primary_key=True),
     Column("username", String, nullable=False),
     Column("hash", String, nullable=False),
-    Column("cash", Float, nullable=False, default=default_cash)
+    Column("cash", Float, nullable=False, default=default_cash),
+    Index("ux_user_username", "username", unique=True),
 )
 
 asset = Table(
@@ -29,9 +30,29 @@ asset = Table(
     Column("symbol", String, nullable=False),
     Column("name", String, nullable=False),
     Column("price", Float),
-    # UniqueConstraint("symbol"),
+    Index("ux_asset_symbol", "symbol", unique=True),
 )
 
+# Full-text index over asset symbol/name (finance.search), an external content
+# fts5 table kept in sync by triggers. Price updates don't touch the index.
+asset_fts = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS asset_fts USING fts5(
+        symbol, name, content='asset', content_rowid='id', prefix='1 2 3'
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS asset_fts_ai AFTER INSERT ON asset BEGIN
+        INSERT INTO asset_fts (rowid, symbol, name) VALUES (new.id, new.symbol, new.name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS asset_fts_ad AFTER DELETE ON asset BEGIN
+        INSERT INTO asset_fts (asset_fts, rowid, symbol, name) VALUES ('delete', old.id, old.symbol, old.name);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS asset_fts_au AFTER UPDATE OF symbol, name ON asset BEGIN
+        INSERT INTO asset_fts (asset_fts, rowid, symbol, name) VALUES ('delete', old.id, old.symbol, old.name);
+        INSERT INTO asset_fts (rowid, symbol, name) VALUES (new.id, new.symbol, new.name);
+    END''',
+]
+for stmt in asset_fts:
+    event.listen(asset, "after_create", DDL(stmt))
+
 trade = Table(
     "trade",
     Base.metadata,
@@ -42,6 +63,9 @@ trade = Table(
     Column("qty", Float, nullable=False),
     Column("price", Float, nullable=False),
     Column("time", TIMESTAMP, server_default=func.now()),
+    Index("ix_trade_user_time", "user_id", "time"),               # history
+    Index("ix_trade_user_asset_time", "user_id", "asset_id", "time"),
+    sqlite_autoincrement=True,  # ids never reused, ledger snapshots count on it
 )
 
 skull = Table(
@@ -58,7 +82,10 @@ holding = Table(
     Base.metadata,
     Column("asset_id", ForeignKey("asset.id"), primary_key=True),
     Column("user_id", ForeignKey("user.id"), primary_key=True),
-    Column("qty", Float, nullable=False)
+    Column("qty", Float, nullable=False),
+    Column("basis", Float, nullable=False, server_default="0"),     # cost of shares held
+    Column("realized", Float, nullable=False, server_default="0"),  # P&L of shares sold
+    Index("ix_holding_user", "user_id"),
 )
 
 # Join table - not mapped
@@ -67,6 +94,7 @@ badge = Table(
     Base.metadata,
     Column("skull_id", ForeignKey("skull.id"), primary_key=True),
     Column("user_id", ForeignKey("user.id"), primary_key=True),
+    Index("ix_badge_user", "user_id"),
 )
 
 # Not mapped
@@ -74,7 +102,112 @@ settings = Table(
     "settings",
     Base.metadata,
     Column("user_id", ForeignKey("user.id")),
-    Column("theme", String, nullable=True)
+    Column("theme", String, nullable=True),
+    Index("ix_settings_user", "user_id"),
+)
+
+# Price history (finance.prices) - raw quotes, one per asset per second
+price_tick = Table(
+    "price_tick",
+    Base.metadata,
+    Column("asset_id", ForeignKey("asset.id"), primary_key=True),
+    Column("time", Integer, primary_key=True),     # unix seconds
+    Column("price", Float, nullable=False),
+    sqlite_with_rowid=False,
+)
+
+# OHLC rollups of price_tick at fixed resolutions, updated as ticks arrive
+price_bar = Table(
+    "price_bar",
+    Base.metadata,
+    Column("asset_id", ForeignKey("asset.id"), primary_key=True),
+    Column("res", Integer, primary_key=True),      # seconds per bar
+    Column("start", Integer, primary_key=True),    # unix seconds
+    Column("open", Float, nullable=False),
+    Column("high", Float, nullable=False),
+    Column("low", Float, nullable=False),
+    Column("close", Float, nullable=False),
+    sqlite_with_rowid=False,
+)
+
+# Resting limit orders (finance.book) - the in-memory books are rebuilt from the open ones
+order = Table(
+    "order",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("type", String, nullable=False),    # buy/sell
+    Column("user_id", ForeignKey("user.id"), nullable=False),
+    Column("asset_id", ForeignKey("asset.id"), nullable=False),
+    Column("qty", Float, nullable=False),
+    Column("price", Float, nullable=False),    # limit
+    Column("state", String, nullable=False, default='open'),  # open/filled/cancelled/rejected
+    Column("time", TIMESTAMP, server_default=func.now()),
+    Index("ix_order_user_state", "user_id", "state"),
+    Index("ix_order_state_asset", "state", "asset_id"),
+    sqlite_autoincrement=True,  # ids never reused, the books key on them
+)
+
+# Background jobs (finance.reset) - progress is shared by every worker
+job = Table(
+    "job",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String, nullable=False),
+    Column("user_id", ForeignKey("user.id"), nullable=True),    # None = all users
+    Column("state", String, nullable=False, default='running'),
+    Column("done", Integer, nullable=False, default=0),
+    Column("total", Integer, nullable=False, default=0),
+    Column("time", TIMESTAMP, server_default=func.now()),   # last progress
+    Index("ix_job_kind_state", "kind", "state"),
+)
+
+# Ledger snapshots (finance.ledger) - cash and positions as of trade_id;
+# only the newest snapshot is kept
+snapshot = Table(
+    "snapshot",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("trade_id", Integer, nullable=False),
+    Column("time", TIMESTAMP, server_default=func.now()),
+)
+
+snapshot_cash = Table(
+    "snapshot_cash",
+    Base.metadata,
+    Column("snapshot_id", Integer, nullable=False),
+    Column("user_id", ForeignKey("user.id"), nullable=False),
+    Column("cash", Float, nullable=False),
+    Index("ix_snapshot_cash_user", "user_id", "snapshot_id"),
+)
+
+snapshot_holding = Table(
+    "snapshot_holding",
+    Base.metadata,
+    Column("snapshot_id", Integer, nullable=False),
+    Column("user_id", ForeignKey("user.id"), nullable=False),
+    Column("asset_id", ForeignKey("asset.id"), nullable=False),
+    Column("qty", Float, nullable=False),
+    Index("ix_snapshot_holding_user", "user_id", "snapshot_id"),
+)
+
+# Derived - maintained by finance.leaderboard
+leaderboard = Table(
+    "leaderboard",
+    Base.metadata,
+    Column("user_id", ForeignKey("user.id"), primary_key=True),
+    Column("name", String, nullable=False),
+    Column("symbol", String, nullable=True),
+    Column("sum", Float, nullable=False, default=0),
+    Index("ix_leaderboard_sum", "sum"),
+)
+
+# Derived - change counters of shared data, for HTTP validators (finance.caching)
+version = Table(
+    "version",
+    Base.metadata,
+    Column("name", String, primary_key=True),
+    Column("n", Integer, nullable=False, default=0),
+    sqlite_with_rowid=False,
 )
 
 # Declarative w imperative table method
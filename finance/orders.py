@@ -0,0 +1,233 @@
+from collections import namedtuple
+
+from sqlalchemy import bindparam, text
+
+from finance import leaderboard, prices, search
+from finance.costbasis import cost_of
+
+
+# Result of an executed order
+Fill = namedtuple("Fill", ["asset_id", "value", "profit"])
+
+
+class Rejected(Exception):
+    """An order failed a cash or inventory check; str(e) is the user message"""
+
+
+def execute(db, user_id, type, symbol, name, price, shares):
+    """Execute a market order inside the caller's transaction, return a Fill
+
+    Cash and inventory checks are guarded UPDATEs, so concurrent orders
+    cannot both pass them. Raises Rejected, after which the caller must
+    roll back; the caller commits on success.
+    """
+    if shares < 1:
+        raise Rejected("bad order")
+    val = shares * price
+    profit = False
+
+    asset_id = db.execute(text('SELECT id FROM asset WHERE symbol = :s'), {"s": symbol}).scalar()
+    if asset_id is None:
+        if type != 'buy':
+            raise Rejected("you don't own it")
+        asset_id = db.execute(text(
+            'INSERT INTO asset (symbol, name, price) VALUES (:s, :n, :p)'
+            ), {"s": symbol, "n": name, "p": price}
+        ).lastrowid
+        search.invalidate()
+    else:
+        db.execute(text('UPDATE asset SET price = :p WHERE id = :a'), {"p": price, "a": asset_id})
+    prices.record(db, [(symbol, price)])
+
+    # buy
+    if type == 'buy':
+        r = db.execute(text(
+            'UPDATE user SET cash = cash - :v WHERE id = :i AND cash >= :v'
+            ), {"v": val, "i": user_id}
+        )
+        if r.rowcount == 0:
+            raise Rejected("rejected low cash")
+        db.execute(text(
+            '''
+            INSERT INTO holding (asset_id, user_id, qty, basis, realized)
+            VALUES (:a, :i, :n, :v, 0)
+            ON CONFLICT (asset_id, user_id) DO UPDATE SET
+                qty = qty + excluded.qty,
+                basis = basis + excluded.basis
+            '''), {"a": asset_id, "i": user_id, "n": shares, "v": val}
+        )
+
+    # sell - at average cost, see finance.costbasis
+    else:
+        h = db.execute(text(
+            'SELECT qty, basis FROM holding WHERE asset_id = :a AND user_id = :i'
+            ), {"a": asset_id, "i": user_id}
+        ).first()
+        if h is None or h.qty == 0:
+            raise Rejected("you don't own it")
+        r = db.execute(text(
+            '''
+            UPDATE holding SET
+                realized = realized + :v - basis * :n / qty,
+                basis = basis - basis * :n / qty,
+                qty = qty - :n
+            WHERE asset_id = :a AND user_id = :i AND qty >= :n
+            '''), {"a": asset_id, "i": user_id, "n": shares, "v": val}
+        )
+        if r.rowcount == 0:
+            raise Rejected("rejected low inventory")
+        profit = val > cost_of(h.basis, h.qty, shares)
+        db.execute(text('UPDATE user SET cash = cash + :v WHERE id = :i'), {"v": val, "i": user_id})
+
+    db.execute(text(
+        'INSERT INTO trade (type, user_id, asset_id, qty, price) VALUES (:t, :i, :a, :n, :p)'
+        ), {"t": type, "i": user_id, "a": asset_id, "n": shares, "p": price}
+    )
+
+    # Reprice every holder of this asset, incl. this user
+    leaderboard.update_asset(db, asset_id)
+    return Fill(asset_id, val, profit)
+
+
+def execute_batch(db, user_id, legs, quotes):
+    """Execute a basket of market orders inside the caller's transaction
+
+    legs is a list of {"symbol", "shares", "type"} dicts, quotes maps each
+    symbol to its quote (or None). Every leg is checked against the cash and
+    inventory left over by the legs before it, rejected legs are reported
+    and skipped. All writes are executemany statements. Returns
+    (results, cash) with one result dict per leg.
+
+    Raises Rejected if the account changed since it was read; the caller
+    must roll back and may retry.
+    """
+    symbols = [symbol for symbol, q in quotes.items() if q is not None]
+    cash = start_cash = db.execute(
+        text('SELECT cash FROM user WHERE id = :i'), {"i": user_id}
+    ).scalar()
+    assets = dict(db.execute(
+        text('SELECT symbol, id FROM asset WHERE symbol IN :s').bindparams(
+            bindparam("s", expanding=True)), {"s": symbols}
+    ).all())
+
+    # symbol -> [qty, basis, realized] as of the last accepted leg
+    pos = {
+        row.symbol: [row.qty, row.basis, 0]
+        for row in db.execute(text(
+            '''
+            SELECT asset.symbol, holding.qty, holding.basis FROM holding, asset
+            WHERE holding.asset_id = asset.id
+            AND holding.user_id = :i
+            AND asset.symbol IN :s
+            ''').bindparams(bindparam("s", expanding=True)), {"i": user_id, "s": symbols}
+        )
+    }
+    start = {symbol: (p[0], p[1]) for symbol, p in pos.items()}
+
+    results = []
+    fills = []
+    for leg in legs:
+        symbol = str(leg.get("symbol") or "").upper()
+        type = leg.get("type")
+        try:
+            shares = int(leg.get("shares"))
+        except (TypeError, ValueError):
+            shares = 0
+        result = {"symbol": symbol, "type": type, "shares": shares}
+        results.append(result)
+
+        error = None
+        quote = quotes.get(symbol)
+        if type not in ('buy', 'sell') or shares < 1:
+            error = "bad order"
+        elif quote is None:
+            error = "no quote"
+        else:
+            price = quote["price"]
+            val = shares * price
+            p = pos.setdefault(symbol, [0, 0, 0])
+            if type == 'buy':
+                if val > cash:
+                    error = "rejected low cash"
+                else:
+                    cash -= val
+                    p[0] += shares
+                    p[1] += val
+            else:
+                if p[0] == 0:
+                    error = "you don't own it"
+                elif shares > p[0]:
+                    error = "rejected low inventory"
+                else:
+                    cost = cost_of(p[1], p[0], shares)
+                    cash += val
+                    p[0] -= shares
+                    p[1] -= cost
+                    p[2] += val - cost
+
+        if error is not None:
+            result.update(status="rejected", error=error)
+        else:
+            result.update(status="filled", price=price)
+            fills.append((symbol, type, shares, price))
+
+    if not fills:
+        return results, start_cash
+
+    # Compare-and-set the balance read above; any concurrent order changes it
+    r = db.execute(text(
+        'UPDATE user SET cash = :c WHERE id = :i AND cash = :c0'
+        ), {"c": cash, "i": user_id, "c0": start_cash}
+    )
+    if r.rowcount == 0:
+        raise Rejected("account changed, try again")
+
+    # Assets - insert new, reprice existing
+    traded = {symbol for symbol, *_ in fills}
+    new = [
+        {"s": symbol, "n": quotes[symbol]["name"], "p": quotes[symbol]["price"]}
+        for symbol in traded if symbol not in assets
+    ]
+    if new:
+        db.execute(text('INSERT INTO asset (symbol, name, price) VALUES (:s, :n, :p)'), new)
+        assets.update(db.execute(
+            text('SELECT symbol, id FROM asset WHERE symbol IN :s').bindparams(
+                bindparam("s", expanding=True)), {"s": [a["s"] for a in new]}
+        ).all())
+        search.invalidate()
+    db.execute(text('UPDATE asset SET price = :p WHERE id = :a'), [
+        {"p": quotes[symbol]["price"], "a": assets[symbol]} for symbol in traded
+    ])
+    prices.record(db, [(symbol, quotes[symbol]["price"]) for symbol in traded])
+
+    # Holdings - apply each symbol's net change
+    db.execute(text(
+        '''
+        INSERT INTO holding (asset_id, user_id, qty, basis, realized)
+        VALUES (:a, :i, :q, :b, :r)
+        ON CONFLICT (asset_id, user_id) DO UPDATE SET
+            qty = qty + excluded.qty,
+            basis = basis + excluded.basis,
+            realized = realized + excluded.realized
+        '''), [
+            {
+                "a": assets[symbol],
+                "i": user_id,
+                "q": pos[symbol][0] - start.get(symbol, (0, 0))[0],
+                "b": pos[symbol][1] - start.get(symbol, (0, 0))[1],
+                "r": pos[symbol][2],
+            }
+            for symbol in traded
+        ]
+    )
+
+    db.execute(text(
+        'INSERT INTO trade (type, user_id, asset_id, qty, price) VALUES (:t, :i, :a, :n, :p)'
+        ), [
+            {"t": type, "i": user_id, "a": assets[symbol], "n": shares, "p": price}
+            for symbol, type, shares, price in fills
+        ]
+    )
+
+    leaderboard.update_assets(db, [assets[symbol] for symbol in traded])
+    return results, cash
@@ -0,0 +1,75 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Password hashing with admission control. At most PASSWORD_QUEUE hashes
+# run or wait per process; beyond that Busy is raised at once, so a login
+# burst is turned away instead of piling up behind PBKDF2. With
+# PASSWORD_WORKERS > 0 the hashes run in a process pool and the request
+# thread only waits on a future.
+
+class Busy(Exception):
+    """PASSWORD_QUEUE hashes are already in progress, try again later"""
+
+
+def pool(app):
+    """Return the app's hashing pool, started on first use (None = hash inline)"""
+    state = app.extensions["passwords"]
+    if app.config["PASSWORD_WORKERS"] <= 0:
+        return None
+    with state["lock"]:
+        if state["pool"] is None:
+            # spawn, not fork: the worker process already runs threads.
+            # Scripts that create the app need the usual __main__ guard.
+            state["pool"] = ProcessPoolExecutor(
+                max_workers=app.config["PASSWORD_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return state["pool"]
+
+
+def run(fn, *args):
+    app = current_app._get_current_object()
+    slots = app.extensions["passwords"]["slots"]
+    if not slots.acquire(blocking=False):
+        raise Busy()
+    try:
+        executor = pool(app)
+        if executor is None:
+            return fn(*args)
+        return executor.submit(fn, *args).result()
+    finally:
+        slots.release()
+
+
+def check(stored, password):
+    """check_password_hash, within the admission limit; raises Busy when saturated"""
+    return run(check_password_hash, stored, password)
+
+
+def generate(password):
+    """generate_password_hash with the configured PASSWORD_METHOD; raises Busy when saturated"""
+    return run(generate_password_hash, password, current_app.config["PASSWORD_METHOD"])
+
+
+def needs_rehash(stored):
+    """True if a stored hash was made with another method or cost than configured"""
+    state = current_app.extensions["passwords"]
+    if state["prefix"] is None:
+        # werkzeug stores the method with its defaults filled in ("scrypt"
+        # -> "scrypt:32768:8:1"), so compare with what it actually writes
+        state["prefix"] = generate_password_hash("", current_app.config["PASSWORD_METHOD"]).split("$", 1)[0]
+    return stored.split("$", 1)[0] != state["prefix"]
+
+
+def init_app(app):
+    app.extensions["passwords"] = {
+        "lock": threading.Lock(),
+        "pool": None,
+        "slots": threading.BoundedSemaphore(app.config["PASSWORD_QUEUE"]),
+        "prefix": None,     # method part of a hash made now, see needs_rehash
+    }
@@ -0,0 +1,147 @@
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from finance.cache import TTLCache
+from finance.model import default_cash
+
+
+# numpy is imported inside the functions that use it, it would otherwise be
+# about half of the app's import time
+
+# Portfolio value after each trade, plus what is needed to mark it to market now
+Series = namedtuple("Series", ["time", "value", "cash", "asset_ids", "qty", "last_price"])
+
+
+def load(db, user_id):
+    """Return a user's trades as columnar arrays, oldest first"""
+    import numpy as np
+
+    rows = db.execute(text(
+        '''
+        SELECT time, type, asset_id, qty, price FROM trade
+        WHERE user_id = :i
+        ORDER BY time, id
+        '''), {"i": user_id}
+    ).all()
+    if not rows:
+        return None
+    time, type, asset_id, qty, price = zip(*rows)
+    return {
+        "time": np.array(time, dtype=object),
+        "buy": np.array(type, dtype=object) == 'buy',
+        "asset_id": np.array(asset_id, dtype=np.int64),
+        "qty": np.array(qty, dtype=np.float64),
+        "price": np.array(price, dtype=np.float64),
+    }
+
+
+def series(trades):
+    """Mark the portfolio to market after every trade, vectorized
+
+    A trade at market price doesn't change portfolio value; what does is
+    each trade re-pricing the position already held in its asset. So the
+    value path is default_cash plus the running sum of
+    (position before trade) * (price - previous trade price) per asset.
+    """
+    import numpy as np
+
+    n = len(trades["qty"])
+    signed = np.where(trades["buy"], trades["qty"], -trades["qty"])
+    price = trades["price"]
+    cash = default_cash - np.cumsum(signed * price)
+
+    # Group trades by asset, keeping time order within each group
+    asset_ids, codes = np.unique(trades["asset_id"], return_inverse=True)
+    order = np.lexsort((np.arange(n), codes))
+    c, s, p = codes[order], signed[order], price[order]
+    start = np.ones(n, dtype=bool)
+    start[1:] = c[1:] != c[:-1]
+
+    # Position held before each trade: exclusive cumsum restarted per group
+    before = np.cumsum(s) - s
+    base = np.maximum.accumulate(np.where(start, np.arange(n), 0))
+    pos_before = before - before[base]
+
+    # Previous trade price in the same asset
+    prev = np.roll(p, 1)
+    prev[start] = p[start]
+
+    gain = np.empty(n)
+    gain[order] = pos_before * (p - prev)
+    value = default_cash + np.cumsum(gain)
+
+    # Final position and last traded price per asset
+    qty = np.bincount(codes, weights=signed, minlength=len(asset_ids))
+    last = np.zeros(len(asset_ids))
+    last[c] = p     # later trades overwrite earlier ones
+
+    return Series(trades["time"], value, cash, asset_ids, qty, last)
+
+
+def stats(values):
+    """Return time-weighted return, volatility and max drawdown of a value path
+
+    Returns are per trade interval; there are no external cash flows, so
+    the time-weighted return chains them directly.
+    """
+    import numpy as np
+
+    r = values[1:] / values[:-1] - 1
+    peak = np.maximum.accumulate(values)
+    return {
+        "twr": float(np.prod(1 + r) - 1) if len(r) else 0.0,
+        "volatility": float(np.std(r, ddof=1)) if len(r) > 1 else 0.0,
+        "max_drawdown": float(np.max(1 - values / peak)),
+    }
+
+
+def report(db, user_id):
+    """Return performance of a user's portfolio as a JSON-able dict, or None
+
+    The per-trade series is memoized per process and keyed on the user's
+    latest trade id; only the final mark at current prices is recomputed.
+    """
+    import numpy as np
+
+    latest = db.execute(
+        text('SELECT max(id) FROM trade WHERE user_id = :i'), {"i": user_id}
+    ).scalar()
+    if latest is None:
+        return None
+
+    cache = current_app.extensions["performance"]
+    hit = cache.get(user_id)
+    if hit is not None and hit[0] == latest:
+        s = hit[1]
+    else:
+        s = series(load(db, user_id))
+        cache.set(user_id, (latest, s))
+
+    # Mark to market at current asset prices
+    now = dict(db.execute(
+        text('SELECT id, price FROM asset WHERE id IN :a').bindparams(bindparam("a", expanding=True)),
+        {"a": s.asset_ids.tolist()}
+    ).all())
+    current = np.array([now.get(a) or p for a, p in zip(s.asset_ids.tolist(), s.last_price)])
+    value_now = s.value[-1] + float(np.dot(s.qty, current - s.last_price))
+    values = np.concatenate(([default_cash], s.value, [value_now]))
+
+    return {
+        "trades": len(s.value),
+        "value": value_now,
+        "cash": float(s.cash[-1]),
+        **stats(values),
+        "series": {
+            "time": [str(t) for t in s.time],
+            "value": s.value.tolist(),
+            "cash": s.cash.tolist(),
+        },
+    }
+
+
+def init_app(app):
+    app.extensions["performance"] = TTLCache(
+        maxsize=app.config["PERFORMANCE_CACHE_SIZE"], ttl=app.config["PERFORMANCE_CACHE_TTL"]
+    )
@@ -0,0 +1,53 @@
+import time
+
+from flask import session
+from sqlalchemy import text
+
+from finance.db import Session
+from finance.model import settings
+
+
+# Preference fields are the columns of the settings table, so a new column
+# becomes a preference without another per-request query
+fields = [c.name for c in settings.columns if c.name != "user_id"]
+
+
+def load(db, user_id):
+    """Return a user's preferences as a dict, one query"""
+    row = db.execute(text(
+        f'SELECT {", ".join(fields)} FROM settings WHERE user_id = :i'
+        ), {"i": user_id}
+    ).first()
+    return dict(zip(fields, row)) if row is not None else dict.fromkeys(fields)
+
+
+def get(name):
+    """Return a preference of the logged in user, cached in the session at login"""
+    if "prefs" not in session:
+        with Session() as db:
+            session["prefs"] = load(db, session["user_id"])
+    return session["prefs"].get(name)
+
+
+def update(user_id, **values):
+    """Save preferences to the settings table and the session cache"""
+    values = {k: v for k, v in values.items() if k in fields}
+    if not values:
+        return
+    with Session() as db:
+        db.execute(text(
+            'UPDATE settings SET ' + ", ".join(f"{k} = :{k}" for k in values) + ' WHERE user_id = :user_id'
+            ), {**values, "user_id": user_id}
+        )
+        db.commit()
+    session["prefs"] = {**session.get("prefs", {}), **values}
+
+
+def resolve_theme(theme):
+    """Return the theme to render with: 'dark' or None (light)"""
+    if theme == 'dark':
+        return 'dark'
+    if theme == 'auto':
+        hr = time.localtime().tm_hour
+        return 'dark' if hr > 18 or hr < 7 else None
+    return None
@@ -0,0 +1,86 @@
+import time
+
+from sqlalchemy import text
+
+
+# Rollup resolutions kept in price_bar, in seconds
+resolutions = (60, 3600, 86400)
+
+# Most bars returned by one query
+max_bars = 1000
+
+
+def record(db, quotes, t=None):
+    """Append (symbol, price) quotes to the price history, inside the caller's transaction
+
+    Each quote is stored as a tick and folded into the bar of every rollup
+    resolution, so range queries never need to scan raw ticks.
+    """
+    if not quotes:
+        return
+    t = int(time.time()) if t is None else t
+    db.execute(text(
+        '''
+        INSERT OR REPLACE INTO price_tick (asset_id, time, price)
+        SELECT id, :t, :p FROM asset WHERE symbol = :s
+        '''), [{"s": symbol, "p": price, "t": t} for symbol, price in quotes]
+    )
+    db.execute(text(
+        '''
+        INSERT INTO price_bar (asset_id, res, start, open, high, low, close)
+        SELECT id, :r, :start, :p, :p, :p, :p FROM asset WHERE symbol = :s
+        ON CONFLICT (asset_id, res, start) DO UPDATE SET
+            high = max(high, excluded.high),
+            low = min(low, excluded.low),
+            close = excluded.close
+        '''), [
+            {"s": symbol, "p": price, "r": r, "start": t - t % r}
+            for symbol, price in quotes
+            for r in resolutions
+        ]
+    )
+
+
+def bars(db, symbol, res, start, end):
+    """Return OHLC bars of `res` seconds for symbol over [start, end), oldest first
+
+    Reads the coarsest stored rollup that evenly divides res and folds it
+    into res-sized bars; resolutions finer than every rollup read ticks.
+    """
+    base = max((r for r in resolutions if r <= res and res % r == 0), default=None)
+    if base is None:
+        rows = db.execute(text(
+            '''
+            SELECT time AS start, price_tick.price AS open, price_tick.price AS high,
+                price_tick.price AS low, price_tick.price AS close
+            FROM price_tick, asset
+            WHERE price_tick.asset_id = asset.id
+            AND asset.symbol = :s
+            AND time >= :a AND time < :b
+            ORDER BY time
+            '''), {"s": symbol, "a": start, "b": end}
+        )
+    else:
+        rows = db.execute(text(
+            '''
+            SELECT start, open, high, low, close
+            FROM price_bar, asset
+            WHERE price_bar.asset_id = asset.id
+            AND asset.symbol = :s
+            AND res = :r
+            AND start >= :a AND start < :b
+            ORDER BY start
+            '''), {"s": symbol, "r": base, "a": start - start % base, "b": end}
+        )
+
+    out = []
+    for row in rows:
+        t = row.start - row.start % res
+        if out and out[-1]["t"] == t:
+            bar = out[-1]
+            bar["h"] = max(bar["h"], row.high)
+            bar["l"] = min(bar["l"], row.low)
+            bar["c"] = row.close
+        else:
+            out.append({"t": t, "o": row.open, "h": row.high, "l": row.low, "c": row.close})
+    return out
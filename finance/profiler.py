@@ -0,0 +1,178 @@
+import cProfile
+import functools
+import hmac
+import inspect
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import abort, current_app, g, jsonify, request
+
+
+# Opt-in profiling of a live worker (PROFILER = True). Two modes:
+#   POST /profile/sample?seconds=10          sample every thread's stack
+#   POST /profile/requests?endpoint=main.index&n=20
+#                                            cProfile the next n requests
+# Output goes to the instance folder: collapsed stacks (.folded, for
+# flamegraph.pl or speedscope) and pstats (.pstats). With PROFILER off
+# nothing is registered, so there is no per-request cost at all.
+
+def output_path(app, name):
+    folder = os.path.join(app.instance_path, "profiles")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+
+def collapse(frame):
+    """Return a frame's stack as 'root;...;leaf' in collapsed-stack format"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sample(path, seconds, interval, done):
+    """Sample the stacks of every other thread for `seconds`, write them collapsed"""
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    counts[collapse(frame)] += 1
+            time.sleep(interval)
+
+        with open(path, "w") as f:
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+    finally:
+        done.release()
+
+
+def start_sampling(app, seconds):
+    """Sample in a daemon thread, return the path the profile will be written to
+
+    Returns None if a sampling run is already going.
+    """
+    sampling = app.extensions["profiler"]["sampling"]
+    if not sampling.acquire(blocking=False):
+        return None
+    path = output_path(app, "sample") + ".folded"
+    threading.Thread(
+        target=sample, args=(path, seconds, app.config["PROFILER_INTERVAL"], sampling),
+        name="profiler-sample", daemon=True,
+    ).start()
+    return path
+
+
+# Request profiling: one cProfile at a time (the interpreter allows only one
+# active profiler), results accumulated until n requests have been seen
+
+def before_request():
+    state = current_app.extensions["profiler"]
+    if state["endpoint"] != request.endpoint or not state["busy"].acquire(blocking=False):
+        return
+    g.profile = cProfile.Profile()
+    g.profile.enable()
+
+
+def profiled(ensure_sync):
+    """Wrap app.ensure_sync so async views are profiled on the thread they run on
+
+    Flask runs an async view on asgiref's event-loop thread, which the
+    request thread's profiler (set per thread) doesn't see.
+    """
+    @functools.wraps(ensure_sync)
+    def wrapper(func):
+        if not inspect.iscoroutinefunction(func):
+            return ensure_sync(func)
+
+        @functools.wraps(func)
+        async def view(*args, **kwargs):
+            if g.get("profile") is None:
+                return await func(*args, **kwargs)
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profile.disable()
+                g.setdefault("profiles", []).append(profile)
+        return ensure_sync(view)
+    return wrapper
+
+
+def teardown_request(e=None):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+    profile.disable()
+    state = current_app.extensions["profiler"]
+    try:
+        for p in [profile] + g.pop("profiles", []):
+            if state["stats"] is None:
+                state["stats"] = pstats.Stats(p)
+            else:
+                state["stats"].add(p)
+        state["remaining"] -= 1
+        if state["remaining"] <= 0:
+            state["stats"].dump_stats(state["path"])
+            state["endpoint"] = state["stats"] = None
+    finally:
+        state["busy"].release()
+
+
+def check_token():
+    """Refuse unless PROFILER_TOKEN is set and sent; with no token nobody gets in"""
+    token = current_app.config["PROFILER_TOKEN"]
+    if not token or not hmac.compare_digest(request.headers.get("X-Profiler-Token", ""), token):
+        abort(403)
+
+
+def sample_view():
+    check_token()
+    seconds = min(request.args.get("seconds", 10, type=float), current_app.config["PROFILER_MAX_SECONDS"])
+    path = start_sampling(current_app._get_current_object(), seconds)
+    if path is None:
+        return jsonify(error="already sampling"), 409
+    return jsonify(path=path, seconds=seconds), 202
+
+
+def requests_view():
+    check_token()
+    endpoint = request.args.get("endpoint")
+    if endpoint not in current_app.view_functions:
+        return jsonify(error="unknown endpoint"), 400
+    state = current_app.extensions["profiler"]
+    with state["busy"]:
+        state["path"] = output_path(current_app, endpoint) + ".pstats"
+        state["remaining"] = request.args.get("n", 10, type=int)
+        state["stats"] = None
+        state["endpoint"] = endpoint
+    return jsonify(path=state["path"], endpoint=endpoint, n=state["remaining"]), 202
+
+
+def init_app(app):
+    if not app.config["PROFILER"]:
+        return
+
+    if not app.config["PROFILER_TOKEN"]:
+        app.logger.warning("PROFILER is on without PROFILER_TOKEN; the profile endpoints refuse every request")
+
+    app.extensions["profiler"] = {
+        "busy": threading.Lock(), "endpoint": None, "remaining": 0, "stats": None, "path": None,
+        "sampling": threading.Lock(),   # one sampling run at a time
+    }
+    app.before_request(before_request)
+    app.teardown_request(teardown_request)
+    app.ensure_sync = profiled(app.ensure_sync)
+
+    # Register the trigger endpoints
+    app.add_url_rule("/profile/sample", endpoint="profile_sample", view_func=sample_view, methods=["POST"])
+    app.add_url_rule("/profile/requests", endpoint="profile_requests", view_func=requests_view, methods=["POST"])
@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from finance.cache import TTLCache
+
+
+def load_api_key():
+    """Put the vendor API key in the environment, once"""
+    if os.environ.get("API_KEY") is None:
+        from hidden import secrets
+        os.environ["API_KEY"] = secrets["api"]
+
+
+def lookup(symbol):
+    """helpers.lookup; the vendor client and its key are loaded on the first call"""
+    from finance import helpers
+    load_api_key()
+    return helpers.lookup(symbol)
+
+
+def get_quotes(symbols, max_age=None, workers=8):
+    """Return {symbol: quote or None}, fetching misses with at most `workers` threads"""
+    if not symbols:
+        return {}
+    # worker threads have no app context, so resolve the cache and logger here
+    cache = current_app.extensions["quotes"]
+    logger = current_app.logger
+
+    def fetch(symbol):
+        try:
+            return cache.get_or_load(symbol, lambda: lookup(symbol), max_age=max_age)
+        except Exception:
+            logger.exception("quote lookup failed: %s", symbol)
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(symbols))) as pool:
+        return dict(zip(symbols, pool.map(fetch, symbols)))
+
+
+# Register the quote cache with the app
+def init_app(app):
+    app.extensions["quotes"] = TTLCache(
+        maxsize=app.config["QUOTE_CACHE_SIZE"],
+        ttl=app.config["QUOTE_TTL"],
+    )
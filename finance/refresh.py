@@ -0,0 +1,111 @@
+import threading
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from finance import book, leaderboard, prices
+from finance.db import Session
+from finance.quotes import get_quotes
+
+
+def held_symbols(db):
+    """Return the symbols of every asset someone actually holds or has an open order on"""
+    return db.execute(text(
+        '''
+        SELECT asset.symbol FROM asset, holding
+        WHERE holding.asset_id = asset.id
+        AND holding.qty > 0
+        UNION
+        SELECT asset.symbol FROM asset, "order"
+        WHERE "order".asset_id = asset.id
+        AND "order".state = 'open'
+        ''')
+    ).scalars().all()
+
+
+def refresh_prices():
+    """Fetch fresh quotes for all held symbols and bulk-update asset.price
+
+    Returns (symbols, updated). Must run inside an app context.
+    """
+    config = current_app.config
+    batch = config["PRICE_REFRESH_BATCH"]
+
+    with Session() as db:
+        symbols = held_symbols(db)
+
+    # Fetch in batches, each with bounded concurrency
+    rows = []
+    for i in range(0, len(symbols), batch):
+        quotes = get_quotes(symbols[i:i + batch], max_age=0,
+            workers=config["PRICE_REFRESH_WORKERS"])
+        rows.extend(
+            {"s": symbol, "p": q["price"]} for symbol, q in quotes.items() if q is not None
+        )
+
+    # One executemany UPDATE per cycle
+    if rows:
+        with Session() as db:
+            db.execute(text('UPDATE asset SET price = :p WHERE symbol = :s'), rows)
+            prices.record(db, [(row["s"], row["p"]) for row in rows])
+
+            # only holders of the repriced assets move on the leaderboard
+            for i in range(0, len(rows), batch):
+                ids = db.execute(
+                    text('SELECT id FROM asset WHERE symbol IN :s').bindparams(bindparam("s", expanding=True)),
+                    {"s": [row["s"] for row in rows[i:i + batch]]},
+                ).scalars().all()
+                leaderboard.update_assets(db, ids)
+            db.commit()
+        book.on_price({row["s"]: row["p"] for row in rows})
+
+    return len(symbols), len(rows)
+
+
+def run(app, stop, interval=None, max_backoff=None):
+    """Refresh prices every `interval` seconds until `stop` is set
+
+    Failed cycles back off exponentially, up to max_backoff seconds.
+    """
+    interval = interval or app.config["PRICE_REFRESH_INTERVAL"]
+    max_backoff = max_backoff or app.config["PRICE_REFRESH_MAX_BACKOFF"]
+    delay = interval
+    while not stop.is_set():
+        try:
+            with app.app_context():
+                symbols, updated = refresh_prices()
+            failed = symbols > 0 and updated == 0
+        except Exception:
+            app.logger.exception("price refresh failed")
+            failed = True
+
+        delay = min(delay * 2, max_backoff) if failed else interval
+        stop.wait(delay)
+
+
+def start(app):
+    """Run the refresher in a daemon thread of this process, return its stop event"""
+    stop = threading.Event()
+    threading.Thread(target=run, args=(app, stop), name="price-refresh", daemon=True).start()
+    return stop
+
+
+# Add cli command
+@click.command("refresh-prices")
+@click.option("--loop", is_flag=True, help="Keep refreshing on a schedule.")
+@click.option("--interval", type=float, default=None, help="Seconds between cycles.")
+def refresh_prices_command(loop, interval):
+    if loop:
+        run(current_app._get_current_object(), threading.Event(), interval=interval)
+    else:
+        symbols, updated = refresh_prices()
+        click.echo(f"Refreshed {updated} of {symbols} held symbols.")
+
+
+def init_app(app):
+    app.cli.add_command(refresh_prices_command)
+
+    # Optional in-process refresher
+    if app.config["PRICE_REFRESH_THREAD"]:
+        app.extensions["price_refresh"] = start(app)
@@ -0,0 +1,152 @@
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from finance import caching, leaderboard
+from finance.db import Session
+from finance.model import default_cash
+
+
+# User data cleared by a reset, in delete order; open orders go first so
+# none fills against a half-reset account, ledger snapshots before the
+# trades they summarize
+tables = ['"order"', "snapshot_cash", "snapshot_holding", "trade", "holding", "badge"]
+
+
+def start(app, user_id=None):
+    """Start resetting one user's data (or everyone's, user_id None) in the background
+
+    Returns the job id, or None when a reset of the same scope is already running.
+    The job keeps to the database bound now, whatever Session is bound to later.
+    """
+    sessions = sessionmaker(bind=Session.kw["bind"])
+    with Session() as db:
+        # a job whose worker died (restart, crash) stops making progress
+        db.execute(text(
+            '''
+            UPDATE job SET state = 'failed'
+            WHERE kind = 'reset' AND state = 'running'
+            AND time < datetime('now', :age)
+            '''), {"age": f"-{app.config['RESET_STALE_AFTER']} seconds"}
+        )
+        running = db.execute(text(
+            '''
+            SELECT id FROM job
+            WHERE kind = 'reset' AND state = 'running'
+            AND (user_id IS :i OR user_id IS NULL)
+            '''), {"i": user_id}
+        ).first()
+        if running is not None:
+            return None
+        job_id = db.execute(text(
+            "INSERT INTO job (kind, user_id, state, done, total) VALUES ('reset', :i, 'running', 0, 0)"
+            ), {"i": user_id}
+        ).lastrowid
+        db.commit()
+
+    threading.Thread(
+        target=run, args=(app, sessions, job_id, user_id), name=f"reset-{job_id}", daemon=True
+    ).start()
+    return job_id
+
+
+def status(job_id):
+    """Return a job's progress row (state, done, total), or None"""
+    with Session() as db:
+        return db.execute(
+            text('SELECT id, state, done, total FROM job WHERE id = :j'), {"j": job_id}
+        ).first()
+
+
+def run(app, sessions, job_id, user_id):
+    """Delete in bounded batches, committing after each to release the write lock"""
+    batch = app.config["RESET_BATCH_SIZE"]
+    pause = app.config["RESET_PAUSE"]
+    try:
+        with sessions() as db:
+            total = sum(count(db, table, user_id) for table in tables)
+            db.execute(text('UPDATE job SET total = :t WHERE id = :j'), {"t": total, "j": job_id})
+            # a log created without AUTOINCREMENT reuses deleted trade ids,
+            # which a ledger snapshot would skip; replays start from the top
+            db.execute(text('DELETE FROM snapshot'))
+            db.commit()
+
+        for table in tables:
+            for _ in batches(sessions, table, user_id, batch, job_id):
+                time.sleep(pause)   # let waiting writers in
+
+        # cash and leaderboard rows, by user id range
+        with sessions() as db:
+            if user_id is not None:
+                db.execute(text('UPDATE user SET cash = :c WHERE id = :i'), {"c": default_cash, "i": user_id})
+                leaderboard.update_user(db, user_id)
+                db.commit()
+            else:
+                last = db.execute(text('SELECT max(id) FROM user')).scalar() or 0
+                for lo in range(0, last, batch):
+                    params = {"c": default_cash, "lo": lo, "hi": lo + batch}
+                    db.execute(text('UPDATE user SET cash = :c WHERE id > :lo AND id <= :hi'), params)
+                    db.execute(text(
+                        'UPDATE leaderboard SET symbol = NULL, sum = 0 WHERE user_id > :lo AND user_id <= :hi'
+                        ), params
+                    )
+                    caching.bump(db, "leaderboard")
+                    db.execute(text('UPDATE job SET time = CURRENT_TIMESTAMP WHERE id = :j'), {"j": job_id})
+                    db.commit()
+                    time.sleep(pause)
+
+            # every process rebuilds its order books from what is left, and
+            # every session reloads its badge bitset
+            caching.bump(db, "order")
+            caching.bump(db, "badges")
+            db.execute(text("UPDATE job SET state = 'done' WHERE id = :j"), {"j": job_id})
+            db.commit()
+    except Exception:
+        app.logger.exception("reset job %s failed", job_id)
+        with sessions() as db:
+            db.execute(text("UPDATE job SET state = 'failed' WHERE id = :j"), {"j": job_id})
+            db.commit()
+
+
+def count(db, table, user_id):
+    if user_id is None:
+        return db.execute(text(f'SELECT count(*) FROM {table}')).scalar()
+    return db.execute(text(f'SELECT count(*) FROM {table} WHERE user_id = :i'), {"i": user_id}).scalar()
+
+
+def batches(sessions, table, user_id, size, job_id):
+    """Delete rows of table in transactions of at most `size` rows, yield after each
+
+    All users: walk the table by rowid range. One user: take the next `size`
+    rowids of that user from the user_id index.
+    """
+    if user_id is None:
+        with sessions() as db:
+            last = db.execute(text(f'SELECT max(rowid) FROM {table}')).scalar() or 0
+        for lo in range(0, last, size):
+            step(sessions, job_id, f'DELETE FROM {table} WHERE rowid > :lo AND rowid <= :hi',
+                {"lo": lo, "hi": lo + size})
+            yield
+    else:
+        while True:
+            n = step(sessions, job_id, f'''
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table} WHERE user_id = :i LIMIT :n
+                )''', {"i": user_id, "n": size})
+            yield
+            if n < size:
+                break
+
+
+def step(sessions, job_id, delete, params):
+    """Run one batch delete and record its progress in the same transaction"""
+    with sessions() as db:
+        n = db.execute(text(delete), params).rowcount
+        db.execute(text(
+            'UPDATE job SET done = done + :n, time = CURRENT_TIMESTAMP WHERE id = :j'
+            ), {"n": n, "j": job_id}
+        )
+        db.commit()
+    return n
@@ -41,6 +41,8 @@ CREATE TABLE holding (
    asset_id INTEGER,
    user_id INTEGER,
    qty NUMERIC,
+   basis NUMERIC NOT NULL DEFAULT 0,
+   realized NUMERIC NOT NULL DEFAULT 0,
    FOREIGN KEY (asset_id) REFERENCES asset(id),
    FOREIGN KEY (user_id) REFERENCES user(id),
    UNIQUE (asset_id,user_id)
@@ -51,4 +53,111 @@ CREATE TABLE badge (
    FOREIGN KEY (skull_id) REFERENCES skull(id),
    FOREIGN KEY (user_id) REFERENCES user(id),
    UNIQUE (skull_id,user_id)
-);
\ No newline at end of file
+);
+-- indexes --
+CREATE INDEX ix_trade_user_time ON trade (user_id, time);
+CREATE INDEX ix_trade_user_asset_time ON trade (user_id, asset_id, time);
+CREATE INDEX ix_holding_user ON holding (user_id);
+CREATE INDEX ix_badge_user ON badge (user_id);
+CREATE INDEX ix_settings_user ON settings (user_id);
+
+-- derived tables --
+CREATE TABLE leaderboard (
+   user_id INTEGER PRIMARY KEY NOT NULL,
+   name TEXT NOT NULL,
+   symbol TEXT,
+   sum NUMERIC NOT NULL DEFAULT 0,
+   FOREIGN KEY (user_id) REFERENCES user(id)
+);
+CREATE INDEX ix_leaderboard_sum ON leaderboard (sum);
+CREATE TABLE version (
+   name TEXT PRIMARY KEY NOT NULL,
+   n INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- full-text index (finance.search) --
+CREATE VIRTUAL TABLE asset_fts USING fts5(
+   symbol, name, content='asset', content_rowid='id', prefix='1 2 3'
+);
+CREATE TRIGGER asset_fts_ai AFTER INSERT ON asset BEGIN
+   INSERT INTO asset_fts (rowid, symbol, name) VALUES (new.id, new.symbol, new.name);
+END;
+CREATE TRIGGER asset_fts_ad AFTER DELETE ON asset BEGIN
+   INSERT INTO asset_fts (asset_fts, rowid, symbol, name) VALUES ('delete', old.id, old.symbol, old.name);
+END;
+CREATE TRIGGER asset_fts_au AFTER UPDATE OF symbol, name ON asset BEGIN
+   INSERT INTO asset_fts (asset_fts, rowid, symbol, name) VALUES ('delete', old.id, old.symbol, old.name);
+   INSERT INTO asset_fts (rowid, symbol, name) VALUES (new.id, new.symbol, new.name);
+END;
+
+-- price history (finance.prices) --
+CREATE TABLE price_tick (
+   asset_id INTEGER NOT NULL,
+   time INTEGER NOT NULL,
+   price NUMERIC NOT NULL,
+   PRIMARY KEY (asset_id, time),
+   FOREIGN KEY (asset_id) REFERENCES asset(id)
+) WITHOUT ROWID;
+CREATE TABLE price_bar (
+   asset_id INTEGER NOT NULL,
+   res INTEGER NOT NULL,
+   start INTEGER NOT NULL,
+   open NUMERIC NOT NULL,
+   high NUMERIC NOT NULL,
+   low NUMERIC NOT NULL,
+   close NUMERIC NOT NULL,
+   PRIMARY KEY (asset_id, res, start),
+   FOREIGN KEY (asset_id) REFERENCES asset(id)
+) WITHOUT ROWID;
+
+-- resting limit orders (finance.book) --
+CREATE TABLE "order" (
+   id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+   type TEXT NOT NULL,
+   user_id INTEGER NOT NULL,
+   asset_id INTEGER NOT NULL,
+   qty NUMERIC NOT NULL,
+   price NUMERIC NOT NULL,
+   state TEXT NOT NULL DEFAULT 'open',
+   time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+   FOREIGN KEY (user_id) REFERENCES user(id),
+   FOREIGN KEY (asset_id) REFERENCES asset(id)
+);
+CREATE INDEX ix_order_user_state ON "order" (user_id, state);
+CREATE INDEX ix_order_state_asset ON "order" (state, asset_id);
+
+-- background jobs (finance.reset) --
+CREATE TABLE job (
+   id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+   kind TEXT NOT NULL,
+   user_id INTEGER,
+   state TEXT NOT NULL DEFAULT 'running',
+   done INTEGER NOT NULL DEFAULT 0,
+   total INTEGER NOT NULL DEFAULT 0,
+   time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+   FOREIGN KEY (user_id) REFERENCES user(id)
+);
+CREATE INDEX ix_job_kind_state ON job (kind, state);
+
+-- ledger snapshots (finance.ledger) --
+CREATE TABLE snapshot (
+   id INTEGER PRIMARY KEY NOT NULL,
+   trade_id INTEGER NOT NULL,
+   time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE snapshot_cash (
+   snapshot_id INTEGER NOT NULL,
+   user_id INTEGER NOT NULL,
+   cash NUMERIC NOT NULL,
+   FOREIGN KEY (user_id) REFERENCES user(id)
+);
+CREATE INDEX ix_snapshot_cash_user ON snapshot_cash (user_id, snapshot_id);
+CREATE TABLE snapshot_holding (
+   snapshot_id INTEGER NOT NULL,
+   user_id INTEGER NOT NULL,
+   asset_id INTEGER NOT NULL,
+   qty NUMERIC NOT NULL,
+   FOREIGN KEY (user_id) REFERENCES user(id),
+   FOREIGN KEY (asset_id) REFERENCES asset(id)
+);
+CREATE INDEX ix_snapshot_holding_user ON snapshot_holding (user_id, snapshot_id);
@@ -0,0 +1,76 @@
+import re
+
+import click
+from flask import current_app
+from sqlalchemy import text
+
+from finance.cache import TTLCache
+from finance.db import Session
+from finance.model import asset_fts
+
+
+# Ranked prefix matches; an exact symbol hit comes first, then bm25 with
+# symbol matches weighted above name matches
+ranked = text(
+    '''
+    SELECT asset.id, asset.symbol, asset.name, asset.price
+    FROM asset_fts, asset
+    WHERE asset_fts MATCH :q
+    AND asset.id = asset_fts.rowid
+    ORDER BY asset.symbol = :sym DESC, bm25(asset_fts, 10.0, 1.0)
+    LIMIT :k
+    ''')
+
+
+def fts_query(s):
+    """Turn user input into an fts5 query matching every word as a prefix"""
+    words = re.findall(r"\w+", s.upper())
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search(db, s, k=8):
+    """Return the top k assets whose symbol or name starts with the words of s
+
+    Results for hot prefixes are served from a per-process cache, which is
+    cleared when this process adds an asset and otherwise expires after
+    SEARCH_CACHE_TTL seconds.
+    """
+    q = fts_query(s)
+    if not q:
+        return []
+    cache = current_app.extensions["search"]
+    key = (q, k)
+    rows = cache.get(key)
+    if rows is None:
+        rows = db.execute(ranked, {"q": q, "sym": s.strip().upper(), "k": k}).all()
+        cache.set(key, rows)
+    return rows
+
+
+def invalidate():
+    """Drop cached results after an asset is added"""
+    current_app.extensions["search"].clear()
+
+
+def create_index(db):
+    """Create the asset_fts table and triggers if missing, and (re)index all assets"""
+    for stmt in asset_fts:
+        db.execute(text(stmt))
+    db.execute(text("INSERT INTO asset_fts (asset_fts) VALUES ('rebuild')"))
+
+
+# Add cli command
+@click.command("index-assets")
+def index_assets_command():
+    with Session() as db:
+        create_index(db)
+        db.commit()
+    click.echo("Asset search index rebuilt.")
+
+
+def init_app(app):
+    app.extensions["search"] = TTLCache(
+        maxsize=app.config["SEARCH_CACHE_SIZE"],
+        ttl=app.config["SEARCH_CACHE_TTL"],
+    )
+    app.cli.add_command(index_assets_command)
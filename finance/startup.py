@@ -0,0 +1,53 @@
+import os
+
+import click
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+
+
+# Worker start-up: templates compile once into a bytecode cache in the
+# instance folder and are reused by every later process; warm-up pays the
+# remaining first-request costs before the worker takes traffic.
+
+def warmup(app):
+    """Compile every template, load deferred modules and fill the DB pool"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    # modules that are otherwise imported by the first request needing them
+    import numpy  # noqa: F401
+    from finance import helpers  # noqa: F401
+    from finance.quotes import load_api_key
+    load_api_key()
+
+    # hashing processes, if configured, so the first login doesn't start them
+    from finance import passwords
+    executor = passwords.pool(app)
+    if executor is not None:
+        list(executor.map(abs, range(app.config["PASSWORD_WORKERS"])))
+
+    # open pool_size connections (running the pragmas), then return them
+    from finance.db import Session
+    engine = Session.kw["bind"]
+    conns = [engine.connect() for _ in range(engine.pool.size())]
+    for conn in conns:
+        conn.exec_driver_sql("SELECT 1")
+        conn.close()
+    return len(conns)
+
+
+# Add cli command
+@click.command("warmup")
+def warmup_command():
+    """Precompile templates into the bytecode cache, e.g. at deploy time"""
+    n = warmup(current_app)
+    click.echo(f"Compiled {len(current_app.jinja_env.list_templates())} templates, opened {n} connections.")
+
+
+def init_app(app):
+    if app.config["JINJA_BYTECODE_CACHE"]:
+        folder = os.path.join(app.instance_path, "jinja-cache")
+        os.makedirs(folder, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(folder)
+
+    app.cli.add_command(warmup_command)
@@ -1,93 +1,152 @@
+import csv
+import io
+import json
 import time
 from flask import (
-    current_app, Blueprint, flash, g, redirect, render_template, request, session, url_for
+    abort, current_app, Blueprint, flash, g, jsonify, redirect, render_template, request,
+    Response, stream_with_context, url_for
 )
-from sqlalchemy import select, text
+from sqlalchemy import text
 
 from finance.auth import login_required
-from finance.db import Session
-from finance.model import User
+from finance import caching, leaderboard, prices
+from finance import performance as perf
+from finance.db import get_session
 
 bp = Blueprint("stat", __name__, url_prefix="/stat")
   
 
+# One user's trades, newest first
+history_sql = '''
+    SELECT trade.id, type, symbol, qty, trade.price, time
+    FROM trade, asset
+    WHERE trade.asset_id = asset.id
+    AND trade.user_id =:i
+    {where}
+    ORDER BY time DESC, trade.id DESC
+'''
+
+
 @bp.route("/history", methods=["GET"])
 @login_required
 def history():
 
     user_id = g.user["id"]
+    per_page = current_app.config["HISTORY_PER_PAGE"]
+
+    # Keyset pagination - the cursor is the (time, id) of the last row shown
+    where = ''
+    params = {"i": user_id, "n": per_page + 1}
+    before = request.args.get("before")
+    if before:
+        t, _, trade_id = before.rpartition("|")
+        if not trade_id.isdigit():
+            abort(400)
+        where = 'AND (time, trade.id) < (:t, :id)'
+        params.update(t=t, id=int(trade_id))
+
+    tb = get_session().execute(
+        text(history_sql.format(where=where) + ' LIMIT :n'), params
+    ).all()
+
+    cursor = None
+    if len(tb) > per_page:
+        tb = tb[:per_page]
+        cursor = f"{tb[-1].time}|{tb[-1].id}"
     
-    # history
-    with Session() as du:
-        tb = du.execute(text('''
-                SELECT type, symbol, qty, trade.price, time
-                FROM trade, asset
-                WHERE trade.asset_id = asset.id
-                AND trade.user_id =:i
-                ORDER BY time DESC
-                    '''), {"i": user_id}
-        ).all()
-    
-    return render_template("/stat/history.html", trades=tb)
+    return render_template("/stat/history.html", trades=tb, cursor=cursor, first=before is None)
+
+
+@bp.route("/history/export", methods=["GET"])
+@login_required
+def export():
+    """Stream the user's full trade history as csv or ndjson"""
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        abort(400)
+    columns = ["id", "type", "symbol", "qty", "price", "time"]
+
+    # Rows are fetched in batches while the response is written, so memory
+    # stays flat however long the history is
+    result = get_session().execute(
+        text(history_sql.format(where='')), {"i": g.user["id"]},
+        execution_options={"yield_per": 1000},
+    )
+
+    def generate():
+        if fmt == "csv":
+            buf = io.StringIO()
+            out = csv.writer(buf)
+            out.writerow(columns)
+            for rows in result.partitions():
+                out.writerows(rows)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            yield buf.getvalue()
+        else:
+            for rows in result.partitions():
+                yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename=history.{fmt}"
+    })
+
+
+@bp.route("/performance", methods=["GET"])
+@login_required
+def performance():
+    """Display portfolio performance over time"""
+
+    report = perf.report(get_session(), g.user["id"])
+    return render_template("/stat/performance.html", report=report)
+
+
+@bp.route("/performance.json", methods=["GET"])
+@login_required
+def performance_json():
+    """Portfolio performance with the full value series, as JSON"""
+
+    report = perf.report(get_session(), g.user["id"])
+    if report is None:
+        return jsonify(trades=0)
+    return jsonify(report)
+
+
+@bp.route("/bars/<symbol>", methods=["GET"])
+@login_required
+def bars(symbol):
+    """OHLC price bars of a symbol as JSON
+
+    Query args: res (seconds per bar, default 3600), start and end (unix
+    seconds, default the latest bars up to now)
+    """
+    res = request.args.get("res", 3600, type=int)
+    if res < 1:
+        abort(400)
+    end = request.args.get("end", int(time.time()), type=int)
+    start = request.args.get("start", end - res * prices.max_bars, type=int)
+    start = max(start, end - res * prices.max_bars)
+
+    rows = prices.bars(get_session(), symbol.upper(), res, start, end)
+    return jsonify(symbol=symbol.upper(), res=res, bars=rows)
 
 
 @bp.route("/leaders")
+@caching.conditional("leaderboard")
 def leaders():
     """Display leaderboard for all users"""
 
-    list = []
-    with Session() as cur:
-
-        # For each user, get largest holding and total asset value (ex-cash)
-        for user in cur.execute(select(User)).scalars().all():
-            user_id = user.id
-            name = user.username
-
-            # Largest symbol - 1 row
-            large = cur.execute(text(
-                '''
-                SELECT symbol, max(qty*price) 
-                FROM holding, asset
-                WHERE holding.asset_id = asset.id
-                AND holding.user_id =:i''' ), {"i": user_id}
-            ).first()
-
-            # Total portfolio - 1 row
-            sum = cur.execute(text(
-                '''
-                SELECT sum(qty*price) 
-                FROM holding, asset
-                WHERE holding.asset_id = asset.id
-                AND holding.user_id =:i'''), {"i": user_id}
-            ).scalar()
-            
-            if sum is not None:
-                dict = {
-                        "user_id": user_id,
-                        "name": name,
-                        "symbol": large.symbol,
-                        "sum": sum
-                }
-            
-            # no holdings for this user
-            else:
-                dict = {
-                        "user_id": user_id,
-                        "name": name,
-                        "symbol": "None",
-                        "sum": 0
-                }
-            if len(list) == 0: # first iteration
-                list.append(dict)
-            elif dict["sum"] < list[-1]["sum"]:
-                list.append(dict)
-            else:
-                for i in range(len(list)):
-                    if dict["sum"] > list[i]["sum"]:
-                        list.insert(i, dict)
-                        break
+    # Ranks are kept current by finance.leaderboard on every trade/quote
+    per_page = current_app.config["LEADERS_PER_PAGE"]
+    page = max(request.args.get("page", 1, type=int), 1)
+    offset = (page - 1) * per_page
+    rows = leaderboard.page(get_session(), limit=per_page + 1, offset=offset)
     
-    return render_template("/stat/leaders.html", list=list)
+    return render_template("/stat/leaders.html", list=rows[:per_page], page=page,
+        offset=offset, more=len(rows) > per_page)
 
 
 @bp.route("/publish", methods=["POST"])
@@ -1,10 +1,46 @@
 
-// db search
+// db search - debounced, only the latest response is shown
 document.addEventListener('DOMContentLoaded', function() {
     var input = document.getElementById('i0');
-    input.addEventListener('input', async function() {
-        let response = await fetch('/search?q=' + input.value);
-        let row = await response.text();
-        document.getElementById('query').innerHTML = row;
+    if (!input) {
+        return;
+    }
+    var timer = null;
+    var pending = null;
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(async function() {
+            if (pending) {
+                pending.abort();
+            }
+            if (input.value.trim() === '') {
+                document.getElementById('query').innerHTML = '';
+                return;
+            }
+            pending = new AbortController();
+            try {
+                let response = await fetch('/search?q=' + encodeURIComponent(input.value), {signal: pending.signal});
+                let rows = await response.text();
+                document.getElementById('query').innerHTML = rows;
+            } catch (e) {
+                // aborted by a newer keystroke
+            }
+        }, 150);
     });
 });
+
+// reset job progress - poll until the job finishes
+document.addEventListener('DOMContentLoaded', function() {
+    var progress = document.getElementById('reset-progress');
+    if (!progress) {
+        return;
+    }
+    var timer = setInterval(async function() {
+        let response = await fetch(progress.dataset.url);
+        let job = await response.json();
+        progress.textContent = 'reset ' + job.state + ': ' + job.done + ' / ' + job.total + ' rows';
+        if (job.state !== 'running') {
+            clearInterval(timer);
+        }
+    }, 1000);
+});
\ No newline at end of file